@@ -1,5 +1,8 @@
 from django.contrib import admin
-from apps.messages.models import Chat, Group, GroupMember, Message, MessageReaction, ReadReceipt
+from apps.messages.models import (
+    Chat, Group, GroupMember, Message, MessageReaction, MessageReactionCount, ReadReceipt, ReadWatermark,
+    ConversationEvent, ConversationSummary
+)
 
 @admin.register(Chat)
 class ChatAdmin(admin.ModelAdmin):
@@ -38,8 +41,35 @@ class MessageReactionAdmin(admin.ModelAdmin):
     readonly_fields = ['id', 'created_at']
 
 
+@admin.register(MessageReactionCount)
+class MessageReactionCountAdmin(admin.ModelAdmin):
+    list_display = ['message', 'emoji', 'count']
+    search_fields = ['emoji', 'message__id']
+
+
 @admin.register(ReadReceipt)
 class ReadReceiptAdmin(admin.ModelAdmin):
     list_display = ['message', 'user', 'read_at']
     search_fields = ['user__phone_number', 'message__id']
     readonly_fields = ['id', 'read_at']
+
+
+@admin.register(ReadWatermark)
+class ReadWatermarkAdmin(admin.ModelAdmin):
+    list_display = ['user', 'chat', 'group', 'last_read_seq', 'last_read_at', 'updated_at']
+    search_fields = ['user__phone_number']
+    readonly_fields = ['id', 'updated_at']
+
+
+@admin.register(ConversationEvent)
+class ConversationEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'position', 'event_type', 'chat', 'group', 'actor', 'created_at']
+    list_filter = ['event_type', 'created_at']
+    readonly_fields = ['id', 'created_at']
+
+
+@admin.register(ConversationSummary)
+class ConversationSummaryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'chat', 'group', 'unread_count', 'is_muted', 'last_activity']
+    search_fields = ['user__phone_number']
+    readonly_fields = ['id']
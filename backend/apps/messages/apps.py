@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def upgrade_existing_rows(sender, **kwargs):
+    """Fill in derived columns for rows written before they existed; a no-op once done"""
+    from apps.messages.models import Chat, Group
+    from apps.messages.persistence import backfill_sequence_numbers
+    from apps.messages.sync import publish_events
+
+    backfill_sequence_numbers(Chat)
+    backfill_sequence_numbers(Group)
+    publish_events()
+
 
 class MessagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.messages'
+
+    def ready(self):
+        post_migrate.connect(upgrade_existing_rows, sender=self)
@@ -1,386 +1,678 @@
-import json
+import asyncio
+from functools import cached_property
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import transaction
 from django.utils import timezone
-from asgiref.sync import sync_to_async
+from asgiref.sync import async_to_sync, sync_to_async
 import logging
 
+from apps.messages.fanout import (
+    get_fanout_pool, get_shard_counts, publish_group_names, subscriber_group_name
+)
+from apps.messages.membership import is_member
+from apps.messages.models import conversation_filter
+from apps.messages.outbound import EPHEMERAL_EVENT_TYPES, OutboundQueue
+from apps.messages.persistence import get_cached_client_message, get_write_buffer
+from apps.messages.ratelimit import FrameRateLimiter
+from apps.messages.protocol import encode_frames, negotiate
+from apps.messages.summaries import refresh_preview
+from apps.messages.sync import record_event
+from apps.messages.typing import TypingCoalescer
+from apps.users.presence import get_presence, presence_ttl
+
 logger = logging.getLogger(__name__)
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for 1-on-1 chats"""
-    
-    async def connect(self):
-        self.chat_id = self.scope['url_route']['kwargs']['chat_id']
-        self.room_group_name = f'chat_{self.chat_id}'
-        self.user = self.scope.get('user')
-        
-        # Verify token and authenticate
-        if not self.user or not self.user.is_authenticated:
-            await self.close()
+# Close code for connections whose outbound queue overflowed
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Channel-layer event types that are renamed on the way out to the client
+OUTBOUND_EVENT_TYPES = {
+    'typing_indicator': 'typing',
+    'read_receipt_received': 'read_receipt',
+}
+
+
+def outbound_payload(event):
+    """Client-facing payload for a channel-layer event"""
+    payload = dict(event)
+    payload['type'] = OUTBOUND_EVENT_TYPES.get(event['type'], event['type'])
+    return payload
+
+
+def conversation_group_name(kind, conversation_id):
+    """Channel-layer group carrying the events of one chat or group"""
+    return f'{kind}_{conversation_id}'
+
+
+def user_group_name(user_id):
+    """Channel-layer group reaching every multiplexed socket of a user"""
+    return f'user_{user_id}'
+
+
+async def send_to_users(user_ids, event):
+    """Push a control event to the multiplexed sockets of the given users concurrently"""
+    channel_layer = get_channel_layer()
+    await asyncio.gather(*[
+        channel_layer.group_send(user_group_name(user_id), dict(event)) for user_id in user_ids
+    ])
+
+
+def notify_users(user_ids, event):
+    """Sync wrapper around ``send_to_users``; one event loop hop however many users"""
+    user_ids = list(user_ids)
+    if user_ids:
+        async_to_sync(send_to_users)(user_ids, event)
+
+
+class ConversationConsumer(AsyncWebsocketConsumer):
+    """Shared frame handling for conversation sockets.
+
+    Subclasses decide which conversations a connection is subscribed to and
+    which conversation an incoming frame belongs to. Conversations are
+    ``(kind, id)`` tuples where kind is ``'chat'`` or ``'group'``.
+    """
+
+    frame_handlers = {
+        'text_message': 'handle_text_message',
+        'typing': 'handle_typing',
+        'read_receipt': 'handle_read_receipt',
+        'message_edit': 'handle_message_edit',
+        'message_delete': 'handle_message_delete',
+        'reaction_add': 'handle_reaction_add',
+        'reaction_remove': 'handle_reaction_remove',
+    }
+
+    # Frames about the connection itself rather than a conversation
+    connection_handlers = {
+        'heartbeat': 'handle_heartbeat',
+    }
+
+    def get_conversation(self, data):
+        """Return the conversation a client frame targets, or None if not allowed"""
+        raise NotImplementedError
+
+    async def accept_connection(self):
+        await self.accept(self.codec.subprotocol)
+        self.outbound.start()
+        await self.touch_presence()
+        self.presence_task = asyncio.ensure_future(self.keep_presence())
+
+    async def keep_presence(self):
+        """Refresh presence while the socket is open; client heartbeats are optional"""
+        while True:
+            await asyncio.sleep(presence_ttl() / 3)
+            try:
+                await self.touch_presence()
+            except Exception as e:
+                logger.error(f"Error refreshing presence: {str(e)}")
+
+    async def touch_presence(self):
+        await sync_to_async(get_presence().touch, thread_sensitive=False)(self.user.id, self.channel_name)
+        self.presence_registered = True
+
+    async def handle_heartbeat(self, data):
+        await self.touch_presence()
+        await self.send_payload({'type': 'heartbeat_ack'})
+
+    async def subscribe(self, conversations):
+        self.conversations = getattr(self, 'conversations', set())
+        self.shards = getattr(self, 'shards', {})
+        new = [c for c in conversations if c not in self.conversations]
+        if not new:
+            return
+        self.conversations.update(new)
+        self.shards.update(await database_sync_to_async(get_shard_counts)(new))
+        await asyncio.gather(*(
+            self.channel_layer.group_add(self.subscription_group(c), self.channel_name)
+            for c in new
+        ))
+
+    async def unsubscribe(self, conversations):
+        old = [c for c in conversations if c in getattr(self, 'conversations', set())]
+        if not old:
             return
-        
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
+        await asyncio.gather(*(
+            self.channel_layer.group_discard(self.subscription_group(c), self.channel_name)
+            for c in old
+        ))
+        self.conversations.difference_update(old)
+        for c in old:
+            self.shards.pop(c, None)
+
+    def subscription_group(self, conversation):
+        """Channel-layer group this connection joins for a conversation"""
+        return subscriber_group_name(
+            conversation_group_name(*conversation), self.channel_name, self.shards.get(conversation, 1)
         )
-        
-        await self.accept()
-        logger.info(f"User {self.user.phone_number} connected to chat {self.chat_id}")
-    
+
+    @cached_property
+    def codec(self):
+        return negotiate(self.scope.get('subprotocols'))
+
+    @cached_property
+    def outbound(self):
+        return OutboundQueue(self.write_frame, self.close_slow_consumer)
+
+    async def write_frame(self, text_data=None, bytes_data=None, close=False):
+        """Writer side of the outbound queue; a frame without data only closes"""
+        if text_data is None and bytes_data is None:
+            await self.close(code=close)
+        else:
+            await self.send(text_data, bytes_data, close)
+
+    async def send_payload(self, payload):
+        self.outbound.put(self.codec.encode(payload))
+
+    def close_when_sent(self):
+        """Close the socket once everything queued so far has been written"""
+        self.outbound.put({'close': True})
+
+    async def close_slow_consumer(self):
+        """Overflow policy: tell the client where to resume, then hang up"""
+        logger.warning(f"Closing slow connection of user {self.user.id}: outbound queue full")
+        await self.send(**self.codec.encode({
+            'type': 'resume',
+            'reason': 'slow_consumer',
+            'positions': [
+                {'conversation_type': kind, 'conversation_id': conversation_id, 'seq': seq}
+                for (kind, conversation_id), seq in self.outbound.delivered.items()
+            ],
+        }))
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    @cached_property
+    def rate_limiter(self):
+        return FrameRateLimiter()
+
+    @cached_property
+    def typing(self):
+        return TypingCoalescer(self.publish_typing, allow_start=lambda: self.rate_limiter.allow('typing'))
+
+    async def join_user_group(self):
+        """Receive control events about this user's conversations"""
+        self.user_group_name = user_group_name(self.user.id)
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-        logger.info(f"User {self.user.phone_number} disconnected from chat {self.chat_id}")
-    
-    async def receive(self, text_data):
+        if 'outbound' in self.__dict__:
+            await self.outbound.stop()
+        if 'typing' in self.__dict__:
+            await self.typing.stop_all()
+        if hasattr(self, 'presence_task'):
+            self.presence_task.cancel()
+        if getattr(self, 'presence_registered', False):
+            await sync_to_async(get_presence().remove, thread_sensitive=False)(self.user.id, self.channel_name)
+        if hasattr(self, 'user_group_name'):
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+        await self.unsubscribe(list(getattr(self, 'conversations', ())))
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            if message_type == 'text_message':
-                await self.handle_text_message(data)
-            elif message_type == 'typing':
-                await self.handle_typing(data)
-            elif message_type == 'read_receipt':
-                await self.handle_read_receipt(data)
-            elif message_type == 'message_edit':
-                await self.handle_message_edit(data)
-            elif message_type == 'message_delete':
-                await self.handle_message_delete(data)
-            elif message_type == 'reaction_add':
-                await self.handle_reaction_add(data)
-            elif message_type == 'reaction_remove':
-                await self.handle_reaction_remove(data)
+            data = self.codec.decode(text_data, bytes_data)
+
+            # Over-budget frames stop here, before any database or Redis work
+            allowed, notify = self.rate_limiter.check(data.get('type'))
+            if not allowed:
+                if notify:
+                    await self.send_payload({
+                        'type': 'throttled',
+                        'frame_type': data.get('type'),
+                        'retry_after': self.rate_limiter.retry_after(data.get('type')),
+                    })
+                return
+
+            if data.get('type') in self.connection_handlers:
+                await getattr(self, self.connection_handlers[data['type']])(data)
+                return
+
+            handler = self.frame_handlers.get(data.get('type'))
+            if handler is None:
+                return
+
+            conversation = self.get_conversation(data)
+            if conversation is None:
+                await self.send_payload({'error': 'Unknown conversation'})
+                return
+
+            await getattr(self, handler)(conversation, data)
         except Exception as e:
-            logger.error(f"Error in chat consumer: {str(e)}")
-            await self.send(text_data=json.dumps({'error': 'Processing error'}))
-    
-    async def handle_text_message(self, data):
+            logger.error(f"Error in {self.__class__.__name__}: {str(e)}")
+            await self.send_payload({'error': 'Processing error'})
+
+    async def broadcast(self, conversation, event):
+        """Send an event to everyone subscribed to the conversation.
+
+        The client payload is encoded here, once, and receivers forward the
+        pre-encoded frames; only routing keys travel alongside them.
+        """
+        kind, conversation_id = conversation
+        event['conversation_type'] = kind
+        event['conversation_id'] = str(conversation_id)
+        envelope = {
+            'type': event['type'],
+            'conversation_type': kind,
+            'conversation_id': event['conversation_id'],
+            'frames': encode_frames(outbound_payload(event)),
+        }
+        if 'seq' in event:
+            envelope['seq'] = event['seq']
+
+        # Large groups are sharded and published by the fan-out workers
+        names = publish_group_names(conversation_group_name(kind, conversation_id), self.shards.get(conversation, 1))
+        if len(names) == 1:
+            await self.channel_layer.group_send(names[0], envelope)
+        else:
+            await get_fanout_pool().publish(self.channel_layer, names, envelope)
+
+    async def handle_text_message(self, conversation, data):
         content = data.get('content')
         message_type = data.get('message_type', 'TEXT')
-        
+        client_msg_id = data.get('client_msg_id')
+        if client_msg_id is not None and not (isinstance(client_msg_id, str) and 0 < len(client_msg_id) <= 64):
+            await self.send_payload({'error': 'Invalid client_msg_id'})
+            return
+
+        # Receivers clear the sender's typing indicator on the message itself
+        self.typing.clear(conversation)
+
+        # A retry of a recently stored message is acknowledged without touching the database
+        if client_msg_id:
+            stored = await sync_to_async(get_cached_client_message, thread_sensitive=False)(self.user.id, client_msg_id)
+            if stored is not None:
+                await self.send_message_ack(client_msg_id, *stored)
+                return
+
         # Save message to database
-        message = await self.save_message(content, message_type)
-        
-        # Broadcast to group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'text_message_received',
-                'message_id': str(message.id),
-                'sender_id': str(self.user.id),
-                'sender_name': self.user.name,
-                'content': message.content,
-                'message_type': message.message_type,
-                'created_at': message.created_at.isoformat(),
-            }
-        )
-    
-    async def handle_typing(self, data):
-        is_typing = data.get('is_typing', False)
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': str(self.user.id),
-                'user_name': self.user.name,
-                'is_typing': is_typing,
-            }
-        )
-    
-    async def handle_read_receipt(self, data):
+        message, created = await self.save_message(conversation, content, message_type, client_msg_id)
+        if message is None:
+            await self.send_payload({'error': 'Message could not be saved'})
+            return
+        if client_msg_id:
+            await self.send_message_ack(client_msg_id, str(message.id), message.seq)
+        if not created:
+            return
+
+        # Broadcast to conversation
+        await self.broadcast(conversation, {
+            'type': 'text_message_received',
+            'message_id': str(message.id),
+            'seq': message.seq,
+            'sender_id': str(self.user.id),
+            'sender_name': self.user.name,
+            'content': message.content,
+            'message_type': message.message_type,
+            'created_at': message.created_at.isoformat(),
+        })
+
+    async def send_message_ack(self, client_msg_id, message_id, seq):
+        await self.send_payload({
+            'type': 'message_ack',
+            'client_msg_id': client_msg_id,
+            'message_id': message_id,
+            'seq': seq,
+        })
+
+    async def handle_typing(self, conversation, data):
+        # Repeated states and keystroke bursts are dropped here, before Redis
+        await self.typing.update(conversation, bool(data.get('is_typing', False)))
+
+    async def publish_typing(self, conversation, is_typing):
+        await self.broadcast(conversation, {
+            'type': 'typing_indicator',
+            'user_id': str(self.user.id),
+            'user_name': self.user.name,
+            'is_typing': is_typing,
+        })
+
+    async def handle_read_receipt(self, conversation, data):
         message_id = data.get('message_id')
-        
-        # Save read receipt
-        await self.save_read_receipt(message_id)
-        
+
+        # Advance the reader's watermark; earlier messages are covered by it,
+        # so there is nothing to broadcast if it did not move
+        if not await self.save_read_receipt(conversation, message_id):
+            return
+
         # Broadcast read receipt
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'read_receipt_received',
-                'message_id': message_id,
-                'reader_id': str(self.user.id),
-                'reader_name': self.user.name,
-                'read_at': timezone.now().isoformat(),
-            }
-        )
-    
-    async def handle_message_edit(self, data):
-        message_id = data.get('message_id')
-        new_content = data.get('content')
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'message_edited',
-                'message_id': message_id,
-                'new_content': new_content,
-                'edited_at': timezone.now().isoformat(),
-            }
-        )
-    
-    async def handle_message_delete(self, data):
-        message_id = data.get('message_id')
+        await self.broadcast(conversation, {
+            'type': 'read_receipt_received',
+            'message_id': message_id,
+            'reader_id': str(self.user.id),
+            'reader_name': self.user.name,
+            'read_at': timezone.now().isoformat(),
+        })
+
+    async def handle_message_edit(self, conversation, data):
+        message = await self.save_message_edit(conversation, data.get('message_id'), data.get('content'))
+        if message is None:
+            await self.send_payload({'error': 'Message cannot be edited'})
+            return
+
+        await self.broadcast(conversation, {
+            'type': 'message_edited',
+            'message_id': str(message.id),
+            'new_content': message.content,
+            'edited_at': message.edited_at.isoformat(),
+        })
+
+    async def handle_message_delete(self, conversation, data):
         mode = data.get('mode', 'self_only')
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'message_deleted',
-                'message_id': message_id,
-                'mode': mode,
-            }
-        )
-    
-    async def handle_reaction_add(self, data):
+        message = await self.save_message_delete(conversation, data.get('message_id'), mode)
+        if message is None:
+            await self.send_payload({'error': 'Message cannot be deleted'})
+            return
+
+        await self.broadcast(conversation, {
+            'type': 'message_deleted',
+            'message_id': str(message.id),
+            'mode': mode,
+        })
+
+    async def handle_reaction_add(self, conversation, data):
         message_id = data.get('message_id')
         emoji = data.get('emoji')
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'reaction_added',
-                'message_id': message_id,
-                'user_id': str(self.user.id),
-                'user_name': self.user.name,
-                'emoji': emoji,
-                'created_at': timezone.now().isoformat(),
-            }
-        )
-    
-    async def handle_reaction_remove(self, data):
+
+        # Repeated reactions change nothing and are not re-broadcast
+        if not await self.save_reaction(conversation, message_id, emoji, add=True):
+            return
+
+        await self.broadcast(conversation, {
+            'type': 'reaction_added',
+            'message_id': message_id,
+            'user_id': str(self.user.id),
+            'user_name': self.user.name,
+            'emoji': emoji,
+            'created_at': timezone.now().isoformat(),
+        })
+
+    async def handle_reaction_remove(self, conversation, data):
         message_id = data.get('message_id')
         emoji = data.get('emoji')
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'reaction_removed',
-                'message_id': message_id,
-                'user_id': str(self.user.id),
-                'emoji': emoji,
-            }
-        )
-    
+
+        if not await self.save_reaction(conversation, message_id, emoji, add=False):
+            return
+
+        await self.broadcast(conversation, {
+            'type': 'reaction_removed',
+            'message_id': message_id,
+            'user_id': str(self.user.id),
+            'emoji': emoji,
+        })
+
+    async def deliver(self, event):
+        """Queue an event for the client; see apps.messages.outbound"""
+        if 'frames' in event:
+            frame = self.codec.forward(event['frames'])
+        else:
+            frame = self.codec.encode(outbound_payload(event))
+
+        position = None
+        if event.get('seq') is not None:
+            position = ((event['conversation_type'], event['conversation_id']), event['seq'])
+        self.outbound.put(frame, ephemeral=event['type'] in EPHEMERAL_EVENT_TYPES, position=position)
+
+    # Control events sent to user_<id> when the user's conversations change
+    async def conversation_added(self, event):
+        # Only the multiplexed socket follows new conversations
+        pass
+
+    async def conversation_removed(self, event):
+        conversation = (event['conversation_type'], event['conversation_id'])
+        if conversation in getattr(self, 'conversations', ()):
+            await self.unsubscribe([conversation])
+            await self.deliver(event)
+
+    async def conversation_resharded(self, event):
+        """Move to the new shard layout of a group; not shown to the client"""
+        conversation = (event['conversation_type'], event['conversation_id'])
+        if conversation not in getattr(self, 'conversations', ()):
+            return
+        old_group = self.subscription_group(conversation)
+        self.shards[conversation] = event['shards']
+        new_group = self.subscription_group(conversation)
+        if new_group != old_group:
+            await self.channel_layer.group_add(new_group, self.channel_name)
+            await self.channel_layer.group_discard(old_group, self.channel_name)
+
     # Event handlers (called by group_send)
     async def text_message_received(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'text_message_received',
-            'message_id': event['message_id'],
-            'sender_id': event['sender_id'],
-            'sender_name': event['sender_name'],
-            'content': event['content'],
-            'message_type': event['message_type'],
-            'created_at': event['created_at'],
-        }))
-    
+        await self.deliver(event)
+
     async def typing_indicator(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing',
-            'user_id': event['user_id'],
-            'user_name': event['user_name'],
-            'is_typing': event['is_typing'],
-        }))
-    
+        await self.deliver(event)
+
     async def read_receipt_received(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'read_receipt',
-            'message_id': event['message_id'],
-            'reader_id': event['reader_id'],
-            'reader_name': event['reader_name'],
-            'read_at': event['read_at'],
-        }))
-    
+        await self.deliver(event)
+
     async def message_edited(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_edited',
-            'message_id': event['message_id'],
-            'new_content': event['new_content'],
-            'edited_at': event['edited_at'],
-        }))
-    
+        await self.deliver(event)
+
     async def message_deleted(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_deleted',
-            'message_id': event['message_id'],
-            'mode': event['mode'],
-        }))
-    
+        await self.deliver(event)
+
     async def reaction_added(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'reaction_added',
-            'message_id': event['message_id'],
-            'user_id': event['user_id'],
-            'user_name': event['user_name'],
-            'emoji': event['emoji'],
-            'created_at': event['created_at'],
-        }))
-    
+        await self.deliver(event)
+
     async def reaction_removed(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'reaction_removed',
-            'message_id': event['message_id'],
-            'user_id': event['user_id'],
-            'emoji': event['emoji'],
-        }))
-    
-    @database_sync_to_async
-    def save_message(self, content, message_type):
-        from apps.messages.models import Message, Chat
-        
+        await self.deliver(event)
+
+    async def save_message(self, conversation, content, message_type, client_msg_id=None):
+        """Returns ``(message, created)``; ``created`` is False for a repeated client_msg_id"""
+        from apps.messages.models import Message
+
+        kind, conversation_id = conversation
         try:
-            chat = Chat.objects.get(id=self.chat_id)
-            message = Message.objects.create(
-                chat=chat,
+            message = Message(
                 sender=self.user,
                 content=content,
-                message_type=message_type
+                message_type=message_type,
+                client_msg_id=client_msg_id,
+                **conversation_filter(kind, conversation_id)
             )
-            return message
+            stored = await get_write_buffer().submit(message)
+            return stored, stored is message
         except Exception as e:
-            logger.error(f"Error saving message: {str(e)}")
-            return None
-    
+            logger.error(f"Error saving {kind} message: {str(e)}")
+            return None, False
+
     @database_sync_to_async
-    def save_read_receipt(self, message_id):
-        from apps.messages.models import Message, ReadReceipt
-        
+    def save_read_receipt(self, conversation, message_id):
+        from apps.messages.models import Message
+        from apps.messages.summaries import mark_read
+
+        kind, conversation_id = conversation
         try:
-            message = Message.objects.get(id=message_id)
-            ReadReceipt.objects.get_or_create(
-                message=message,
-                user=self.user
+            message = Message.objects.only('id', 'chat_id', 'group_id', 'seq', 'created_at').get(
+                id=message_id,
+                **conversation_filter(kind, conversation_id)
             )
+            return mark_read(self.user, message)
         except Exception as e:
             logger.error(f"Error saving read receipt: {str(e)}")
+            return False
 
+    def get_own_message(self, conversation, message_id):
+        from apps.messages.models import Message
+
+        kind, conversation_id = conversation
+        return Message.objects.filter(
+            id=message_id,
+            sender=self.user,
+            is_deleted=False,
+            **conversation_filter(kind, conversation_id)
+        ).first()
+
+    @database_sync_to_async
+    def save_message_edit(self, conversation, message_id, content):
+        from apps.messages.models import Message
 
-class GroupConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for group chats"""
-    
-    async def connect(self):
-        self.group_id = self.scope['url_route']['kwargs']['group_id']
-        self.room_group_name = f'group_{self.group_id}'
-        self.user = self.scope.get('user')
-        
-        if not self.user or not self.user.is_authenticated:
-            await self.close()
-            return
-        
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-        
-        await self.accept()
-        logger.info(f"User {self.user.phone_number} connected to group {self.group_id}")
-    
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-    
-    async def receive(self, text_data):
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            if message_type == 'text_message':
-                await self.handle_text_message(data)
-            elif message_type == 'typing':
-                await self.handle_typing(data)
-            elif message_type == 'read_receipt':
-                await self.handle_read_receipt(data)
+            message = self.get_own_message(conversation, message_id)
+            if message is None or not content:
+                return None
+            if timezone.now() - message.created_at > Message.EDIT_WINDOW:
+                return None
+
+            message.content = content
+            message.edited_at = timezone.now()
+            with transaction.atomic():
+                message.save(update_fields=['content', 'edited_at'])
+                record_event('EDIT', message, actor=self.user)
+                refresh_preview(message)
+            return message
         except Exception as e:
-            logger.error(f"Error in group consumer: {str(e)}")
-    
-    async def handle_text_message(self, data):
-        content = data.get('content')
-        message_type = data.get('message_type', 'TEXT')
-        
-        message = await self.save_message(content, message_type)
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'text_message_received',
-                'message_id': str(message.id),
-                'sender_id': str(self.user.id),
-                'sender_name': self.user.name,
-                'content': message.content,
-                'message_type': message.message_type,
-                'created_at': message.created_at.isoformat(),
-            }
-        )
-    
-    async def handle_typing(self, data):
-        is_typing = data.get('is_typing', False)
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': str(self.user.id),
-                'user_name': self.user.name,
-                'is_typing': is_typing,
-            }
-        )
-    
-    async def handle_read_receipt(self, data):
-        message_id = data.get('message_id')
-        await self.save_read_receipt(message_id)
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'read_receipt_received',
-                'message_id': message_id,
-                'reader_id': str(self.user.id),
-                'read_at': timezone.now().isoformat(),
-            }
-        )
-    
-    async def text_message_received(self, event):
-        await self.send(text_data=json.dumps(event))
-    
-    async def typing_indicator(self, event):
-        await self.send(text_data=json.dumps(event))
-    
-    async def read_receipt_received(self, event):
-        await self.send(text_data=json.dumps(event))
-    
+            logger.error(f"Error editing message: {str(e)}")
+            return None
+
     @database_sync_to_async
-    def save_message(self, content, message_type):
-        from apps.messages.models import Message, Group
-        
+    def save_message_delete(self, conversation, message_id, mode):
         try:
-            group = Group.objects.get(id=self.group_id)
-            message = Message.objects.create(
-                group=group,
-                sender=self.user,
-                content=content,
-                message_type=message_type
-            )
+            message = self.get_own_message(conversation, message_id)
+            if message is None:
+                return None
+
+            if mode == 'everyone':
+                message.is_deleted = True
+            else:
+                message.deleted_by_sender_only = True
+            with transaction.atomic():
+                message.save(update_fields=['is_deleted', 'deleted_by_sender_only'])
+                record_event('DELETE', message, actor=self.user, mode=mode)
+                if message.is_deleted:
+                    refresh_preview(message)
             return message
         except Exception as e:
-            logger.error(f"Error saving group message: {str(e)}")
+            logger.error(f"Error deleting message: {str(e)}")
             return None
-    
+
     @database_sync_to_async
-    def save_read_receipt(self, message_id):
-        from apps.messages.models import Message, ReadReceipt
-        
+    def save_reaction(self, conversation, message_id, emoji, add):
+        """Add or remove a reaction; returns True if anything changed"""
+        from apps.messages.models import Message, MessageReaction, MessageReactionCount
+
+        kind, conversation_id = conversation
         try:
-            message = Message.objects.get(id=message_id)
-            ReadReceipt.objects.get_or_create(
-                message=message,
-                user=self.user
+            message = Message.objects.only('id', 'chat_id', 'group_id').get(
+                id=message_id,
+                **conversation_filter(kind, conversation_id)
             )
+            with transaction.atomic():
+                if add:
+                    _, changed = MessageReaction.objects.get_or_create(message=message, user=self.user, emoji=emoji)
+                else:
+                    changed = MessageReaction.objects.filter(message=message, user=self.user, emoji=emoji).delete()[0] > 0
+                if changed:
+                    MessageReactionCount.adjust(message.id, emoji, 1 if add else -1)
+                    record_event('REACTION_ADD' if add else 'REACTION_REMOVE', message, actor=self.user, emoji=emoji)
+            return changed
         except Exception as e:
-            logger.error(f"Error saving read receipt: {str(e)}")
+            logger.error(f"Error saving reaction: {str(e)}")
+            return False
+
+    @database_sync_to_async
+    def check_membership(self, kind, conversation_id):
+        return is_member(kind, conversation_id, self.user.id)
+
+
+class ChatConsumer(ConversationConsumer):
+    """WebSocket consumer for 1-on-1 chats"""
+
+    async def connect(self):
+        self.chat_id = str(self.scope['url_route']['kwargs']['chat_id'])
+        self.user = self.scope.get('user')
+
+        # Verify token and authenticate
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        if not await self.check_membership('chat', self.chat_id):
+            await self.close()
+            return
+
+        await self.join_user_group()
+        await self.subscribe([('chat', self.chat_id)])
+        await self.accept_connection()
+        logger.info(f"User {self.user.phone_number} connected to chat {self.chat_id}")
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'conversations', None):
+            logger.info(f"User {self.user.phone_number} disconnected from chat {self.chat_id}")
+        await super().disconnect(close_code)
+
+    def get_conversation(self, data):
+        return ('chat', self.chat_id)
+
+    async def conversation_removed(self, event):
+        await super().conversation_removed(event)
+        if not self.conversations:
+            self.close_when_sent()
+
+
+class GroupConsumer(ConversationConsumer):
+    """WebSocket consumer for group chats"""
+
+    async def connect(self):
+        self.group_id = str(self.scope['url_route']['kwargs']['group_id'])
+        self.user = self.scope.get('user')
+
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        if not await self.check_membership('group', self.group_id):
+            await self.close()
+            return
+
+        await self.join_user_group()
+        await self.subscribe([('group', self.group_id)])
+        await self.accept_connection()
+        logger.info(f"User {self.user.phone_number} connected to group {self.group_id}")
+
+    def get_conversation(self, data):
+        return ('group', self.group_id)
+
+    async def conversation_removed(self, event):
+        await super().conversation_removed(event)
+        if not self.conversations:
+            self.close_when_sent()
+
+
+class UserConsumer(ConversationConsumer):
+    """Multiplexed WebSocket carrying every chat and group of a user.
+
+    Client frames name their target with ``conversation_type`` ('chat' or
+    'group') and ``conversation_id``; outgoing events carry the same keys.
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        await self.join_user_group()
+        await self.subscribe(await self.get_user_conversations())
+        await self.accept_connection()
+        logger.info(f"User {self.user.phone_number} connected with {len(self.conversations)} conversations")
+
+    def get_conversation(self, data):
+        conversation = (data.get('conversation_type'), str(data.get('conversation_id')))
+        if conversation in self.conversations:
+            return conversation
+        return None
+
+    async def conversation_added(self, event):
+        await self.subscribe([(event['conversation_type'], event['conversation_id'])])
+        await self.deliver(event)
+
+    @database_sync_to_async
+    def get_user_conversations(self):
+        from apps.messages.models import ConversationSummary
+
+        return [
+            ('chat', str(chat_id)) if chat_id else ('group', str(group_id))
+            for chat_id, group_id in ConversationSummary.objects.filter(user=self.user).values_list('chat_id', 'group_id')
+        ]
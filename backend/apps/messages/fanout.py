@@ -0,0 +1,155 @@
+"""Sharded fan-out for large groups.
+
+Subscribers of a conversation normally share one channel-layer group. Once a
+group reaches ``FANOUT_SHARD_THRESHOLD`` members its subscribers are spread
+over ``FANOUT_SHARD_COUNT`` sub-groups (``group_<id>_<shard>``, picked by
+hashing the channel name), so no single Redis group key carries every
+member. Events for sharded groups are handed to a per-event-loop worker
+pool that publishes to each shard in the background instead of blocking the
+sending consumer.
+
+The shard count is stored on ``Group.fanout_shards`` and re-evaluated by
+``update_shard_count`` whenever membership changes. It only drops back to
+one shard below half the threshold, so groups hovering around it do not
+flip between layouts. Subscribers move to the new layout when they receive
+the ``conversation_resharded`` control event; clients recover anything
+missed during the switch through sequence gaps.
+"""
+
+import asyncio
+import logging
+import weakref
+import zlib
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.messages import metrics
+
+logger = logging.getLogger(__name__)
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def shards_cache_key(group_id):
+    return f'fanout:shards:group:{group_id}'
+
+
+def subscriber_group_name(base, channel_name, shards):
+    """Channel-layer group a subscriber joins for a conversation"""
+    if shards <= 1:
+        return base
+    return f'{base}_{zlib.crc32(channel_name.encode()) % shards}'
+
+
+def publish_group_names(base, shards):
+    """Channel-layer groups an event must be sent to, one per shard"""
+    if shards <= 1:
+        return [base]
+    return [f'{base}_{shard}' for shard in range(shards)]
+
+
+def desired_shard_count(member_count, current=1):
+    threshold = getattr(settings, 'FANOUT_SHARD_THRESHOLD', 1000)
+    if member_count >= threshold:
+        return getattr(settings, 'FANOUT_SHARD_COUNT', 16)
+    if member_count < threshold // 2:
+        return 1
+    return current
+
+
+def get_shard_counts(conversations):
+    """Return ``{conversation: shard count}``; chats are never sharded"""
+    from apps.messages.models import Group
+
+    counts = {c: 1 for c in conversations if c[0] != 'group'}
+    keys = {shards_cache_key(c[1]): c for c in conversations if c[0] == 'group'}
+    cached = cache.get_many(list(keys))
+    for key, conversation in keys.items():
+        if key in cached:
+            counts[conversation] = cached[key]
+
+    missing = {c[1]: c for key, c in keys.items() if key not in cached}
+    if missing:
+        found = dict(Group.objects.filter(id__in=list(missing)).values_list('id', 'fanout_shards'))
+        found = {str(group_id): shards for group_id, shards in found.items()}
+        for group_id, conversation in missing.items():
+            counts[conversation] = found.get(group_id, 1)
+        cache.set_many(
+            {shards_cache_key(group_id): found.get(group_id, 1) for group_id in missing},
+            getattr(settings, 'MEMBERSHIP_CACHE_TTL', 300)
+        )
+    return counts
+
+
+def update_shard_count(group_id):
+    """Re-evaluate a group's layout after a membership change (sync callers).
+
+    Subscribers in the old layout are told to move with a
+    ``conversation_resharded`` event.
+    """
+    from apps.messages.consumers import conversation_group_name
+    from apps.messages.membership import get_member_ids
+    from apps.messages.models import Group
+
+    current = Group.objects.filter(id=group_id).values_list('fanout_shards', flat=True).first()
+    if current is None:
+        return
+    wanted = desired_shard_count(len(get_member_ids('group', group_id)), current)
+    if wanted == current:
+        return
+
+    Group.objects.filter(id=group_id).update(fanout_shards=wanted)
+    cache.delete(shards_cache_key(group_id))
+    logger.info(f"Group {group_id} resharded from {current} to {wanted} fan-out shards")
+
+    channel_layer = get_channel_layer()
+    for name in publish_group_names(conversation_group_name('group', group_id), current):
+        async_to_sync(channel_layer.group_send)(name, {
+            'type': 'conversation_resharded',
+            'conversation_type': 'group',
+            'conversation_id': str(group_id),
+            'shards': wanted,
+        })
+
+
+class FanoutPool:
+    """Background workers publishing events to the shards of large groups.
+
+    Shard ``n`` is always published by worker ``n % workers``, so events for
+    one shard leave in the order they were submitted.
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        workers = workers or getattr(settings, 'FANOUT_WORKERS', 4)
+        queue_size = queue_size or getattr(settings, 'FANOUT_QUEUE_SIZE', 10000)
+        self.queues = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self.tasks = [asyncio.ensure_future(self._work(queue)) for queue in self.queues]
+
+    async def publish(self, channel_layer, group_names, message):
+        """Queue one send per shard; waits only if the workers are behind"""
+        for shard, name in enumerate(group_names):
+            await self.queues[shard % len(self.queues)].put((channel_layer, name, message))
+            metrics.gauge_add('fanout.queued_sends', 1)
+
+    async def _work(self, queue):
+        while True:
+            channel_layer, name, message = await queue.get()
+            metrics.gauge_add('fanout.queued_sends', -1)
+            try:
+                await channel_layer.group_send(name, message)
+                metrics.increment('fanout.sends')
+            except Exception as e:
+                logger.error(f"Fan-out to {name} failed: {str(e)}")
+                metrics.increment('fanout.errors')
+
+
+def get_fanout_pool():
+    """Return the fan-out pool bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = FanoutPool()
+    return pool
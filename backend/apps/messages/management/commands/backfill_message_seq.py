@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from apps.messages.models import Chat, Group
+from apps.messages.persistence import backfill_sequence_numbers
+
+
+class Command(BaseCommand):
+    help = 'Number messages sent before Message.seq existed and set Chat/Group.last_seq; migrate also does this'
+
+    def handle(self, *args, **options):
+        renumbered = backfill_sequence_numbers(Chat) + backfill_sequence_numbers(Group)
+        self.stdout.write(self.style.SUCCESS(f'Numbered messages in {renumbered} conversations'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.messages.models import ReadWatermark
+
+
+class Command(BaseCommand):
+    help = 'Seed ReadWatermark rows from legacy ReadReceipt rows; run after migrate and before rebuild_conversation_summaries'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = ReadWatermark.backfill_from_receipts()
+        self.stdout.write(self.style.SUCCESS(f'{changed} read watermarks created or moved'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.messages.models import ConversationSummary
+from apps.messages.summaries import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute inbox ConversationSummary rows from chats, memberships, messages and read watermarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', help='only these users (default: all)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild(options['user_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'{ConversationSummary.objects.count()} conversation summaries stored'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.messages.models import MessageReactionCount
+
+
+class Command(BaseCommand):
+    help = 'Recompute MessageReactionCount rows from the individual reactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('message_ids', nargs='*', help='only these messages (default: all)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            MessageReactionCount.rebuild(options['message_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'{MessageReactionCount.objects.count()} reaction counts stored'))
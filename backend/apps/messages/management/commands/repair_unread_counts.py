@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.messages.summaries import repair_unread
+
+
+class Command(BaseCommand):
+    help = 'Recompute unread counters on ConversationSummary rows from messages and read watermarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', help='only these users (default: all)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = repair_unread(options['user_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'{fixed} unread counters corrected'))
@@ -0,0 +1,42 @@
+"""Cached conversation membership.
+
+Members of a chat are its two users; members of a group are the
+``GroupMember`` rows with ``left_at`` unset. The set of member ids is cached
+per conversation and must be invalidated with ``invalidate_members`` whenever
+it changes.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def members_cache_key(kind, conversation_id):
+    return f'members:{kind}:{conversation_id}'
+
+
+def get_member_ids(kind, conversation_id):
+    """Return the ids (as strings) of the conversation's current members"""
+    from apps.messages.models import Chat, GroupMember
+
+    key = members_cache_key(kind, conversation_id)
+    member_ids = cache.get(key)
+    if member_ids is None:
+        if kind == 'chat':
+            pair = Chat.objects.filter(id=conversation_id).values_list('user1_id', 'user2_id').first()
+            member_ids = frozenset(str(user_id) for user_id in pair or ())
+        else:
+            member_ids = frozenset(
+                str(user_id) for user_id in GroupMember.objects.filter(
+                    group_id=conversation_id, left_at__isnull=True
+                ).values_list('user_id', flat=True)
+            )
+        cache.set(key, member_ids, getattr(settings, 'MEMBERSHIP_CACHE_TTL', 300))
+    return member_ids
+
+
+def is_member(kind, conversation_id, user_id):
+    return str(user_id) in get_member_ids(kind, conversation_id)
+
+
+def invalidate_members(kind, conversation_id):
+    cache.delete(members_cache_key(kind, conversation_id))
@@ -0,0 +1,46 @@
+"""In-process counters and gauges for the realtime layer.
+
+Values are per worker process and reset on restart; ``snapshot`` returns a
+copy for logging, benchmarks or an exporter.
+"""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = defaultdict(int)
+_peaks = defaultdict(int)
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def gauge_add(name, amount):
+    """Move a gauge up or down, remembering its highest value"""
+    with _lock:
+        _gauges[name] += amount
+        _peaks[name] = max(_peaks[name], _gauges[name])
+
+
+def observe_max(name, value):
+    with _lock:
+        _peaks[name] = max(_peaks[name], value)
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'peaks': dict(_peaks),
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _peaks.clear()
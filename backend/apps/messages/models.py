@@ -1,12 +1,28 @@
 import uuid
+from datetime import timedelta
 from django.db import models
+from django.utils import timezone
 from apps.users.models import User
 
+
+def conversation_of(obj):
+    """``(kind, id)`` of the chat or group a message, event, summary or watermark belongs to"""
+    if obj.chat_id:
+        return 'chat', obj.chat_id
+    return 'group', obj.group_id
+
+
+def conversation_filter(kind, conversation_id):
+    """Lookup keyword arguments for the rows of one chat or group"""
+    return {f'{kind}_id': conversation_id}
+
+
 class Chat(models.Model):
     """1-on-1 chat between two users"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chats_as_user1')
     user2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chats_as_user2')
+    last_seq = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -40,6 +56,11 @@ class Group(models.Model):
     group_picture_url = models.CharField(max_length=500, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='groups_created')
+    last_seq = models.BigIntegerField(default=0)
+    # Number of channel-layer sub-groups subscribers are spread over; see apps.messages.fanout
+    fanout_shards = models.PositiveSmallIntegerField(default=1)
+    # Bumped whenever the member list or a member's profile changes; see apps.messages.roster
+    roster_version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -87,6 +108,10 @@ class Message(models.Model):
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, null=True, blank=True, related_name='messages')
     group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.PROTECT, related_name='messages_sent')
+    # Position within the chat/group, gap-free and increasing; see assign_sequence_numbers
+    seq = models.BigIntegerField(null=True, blank=True)
+    # Optional id chosen by the sending client; retries with the same id resolve to this message
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
     content = models.TextField()
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPES, default='TEXT')
     is_deleted = models.BooleanField(default=False)
@@ -95,12 +120,33 @@ class Message(models.Model):
     edited_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # How long after sending the sender may still edit a message
+    EDIT_WINDOW = timedelta(minutes=15)
+    
     class Meta:
         ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['chat', 'seq'],
+                condition=models.Q(chat__isnull=False),
+                name='unique_chat_message_seq'
+            ),
+            models.UniqueConstraint(
+                fields=['group', 'seq'],
+                condition=models.Q(group__isnull=False),
+                name='unique_group_message_seq'
+            ),
+            models.UniqueConstraint(
+                fields=['sender', 'client_msg_id'],
+                condition=models.Q(client_msg_id__isnull=False),
+                name='unique_sender_client_msg_id'
+            ),
+        ]
         indexes = [
-            models.Index(fields=['chat', '-created_at']),
-            models.Index(fields=['group', '-created_at']),
+            models.Index(fields=['chat', '-created_at', '-id']),
+            models.Index(fields=['group', '-created_at', '-id']),
             models.Index(fields=['sender']),
+            models.Index(fields=['id'], condition=models.Q(seq__isnull=True), name='unnumbered_message_idx'),
         ]
     
     def __str__(self):
@@ -125,8 +171,48 @@ class MessageReaction(models.Model):
         return f"{self.user.phone_number} reacted {self.emoji} to message {self.message.id}"
 
 
+class MessageReactionCount(models.Model):
+    """Number of reactions per (message, emoji), kept in step with MessageReaction"""
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reaction_counts')
+    emoji = models.CharField(max_length=10)
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'emoji'], name='unique_message_reaction_count'),
+        ]
+    
+    def __str__(self):
+        return f"{self.emoji} x{self.count} on message {self.message_id}"
+    
+    @classmethod
+    def adjust(cls, message_id, emoji, delta):
+        """Add ``delta`` to a count; call in the transaction that adds or removes the reaction"""
+        if delta > 0:
+            _, created = cls.objects.get_or_create(message_id=message_id, emoji=emoji, defaults={'count': delta})
+            if created:
+                return
+        cls.objects.filter(message_id=message_id, emoji=emoji).update(count=models.F('count') + delta)
+        if delta < 0:
+            cls.objects.filter(message_id=message_id, emoji=emoji, count__lte=0).delete()
+    
+    @classmethod
+    def rebuild(cls, message_ids=None):
+        """Recompute counts from MessageReaction rows, for all or the given messages"""
+        reactions = MessageReaction.objects.all()
+        counts = cls.objects.all()
+        if message_ids is not None:
+            reactions = reactions.filter(message_id__in=message_ids)
+            counts = counts.filter(message_id__in=message_ids)
+        counts.delete()
+        cls.objects.bulk_create([
+            cls(message_id=row['message_id'], emoji=row['emoji'], count=row['count'])
+            for row in reactions.values('message_id', 'emoji').annotate(count=models.Count('id'))
+        ], batch_size=1000)
+
+
 class ReadReceipt(models.Model):
-    """Read receipts for messages"""
+    """Per-message read receipts (legacy, superseded by ReadWatermark)"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='read_receipts')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -140,3 +226,211 @@ class ReadReceipt(models.Model):
     
     def __str__(self):
         return f"{self.user.phone_number} read message {self.message.id}"
+
+
+class ReadWatermark(models.Model):
+    """How far a user has read in a chat or group.
+
+    A message counts as read by every participant whose watermark is at or
+    past its ``seq``, so one row per (user, conversation) replaces a receipt
+    row per message per reader. ``last_read_at`` is kept for display.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_watermarks')
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, null=True, blank=True, related_name='read_watermarks')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='read_watermarks')
+    last_read_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_read_seq = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'chat'],
+                condition=models.Q(chat__isnull=False),
+                name='unique_chat_read_watermark'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'group'],
+                condition=models.Q(group__isnull=False),
+                name='unique_group_read_watermark'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['chat', 'last_read_seq']),
+            models.Index(fields=['group', 'last_read_seq']),
+            models.Index(fields=['chat', '-updated_at']),
+            models.Index(fields=['group', '-updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.phone_number} read up to {self.last_read_at}"
+    
+    @classmethod
+    def advance(cls, user, message):
+        """Move the user's watermark forward to ``message``.
+        
+        Returns True if the watermark moved, False if it was already at or
+        past the message. Older messages never move it backwards. Messages
+        not numbered yet (see ``backfill_sequence_numbers``) are compared by
+        ``created_at`` and leave ``last_read_seq`` alone.
+        """
+        conversation = conversation_filter(*conversation_of(message))
+        if message.seq is None:
+            behind, read_seq = models.Q(last_read_at__lt=message.created_at), models.F('last_read_seq')
+        else:
+            behind, read_seq = models.Q(last_read_seq__lt=message.seq), message.seq
+        updated = cls.objects.filter(behind, user=user, **conversation).update(
+            last_read_message=message,
+            last_read_seq=read_seq,
+            last_read_at=message.created_at,
+            updated_at=timezone.now()
+        )
+        if updated:
+            return True
+        
+        _, created = cls.objects.get_or_create(
+            user=user,
+            defaults={
+                'last_read_message': message,
+                'last_read_seq': message.seq or 0,
+                'last_read_at': message.created_at,
+            },
+            **conversation
+        )
+        return created
+    
+    @classmethod
+    def backfill_from_receipts(cls):
+        """Seed watermarks from legacy ReadReceipt rows.
+        
+        Each (user, conversation) watermark moves to the newest message the
+        user has a receipt for; watermarks already past it are kept. Returns
+        the number of watermarks created or moved.
+        """
+        newest = {}
+        for user_id, message_id, chat_id, group_id, seq, created_at in ReadReceipt.objects.filter(
+            message__seq__isnull=False
+        ).values_list(
+            'user_id', 'message_id', 'message__chat_id', 'message__group_id', 'message__seq', 'message__created_at'
+        ).iterator():
+            key = (user_id, chat_id, group_id)
+            if key not in newest or seq > newest[key][0]:
+                newest[key] = (seq, message_id, created_at)
+        
+        existing = {(w.user_id, w.chat_id, w.group_id): w for w in cls.objects.all()}
+        created, moved = [], []
+        for (user_id, chat_id, group_id), (seq, message_id, created_at) in newest.items():
+            watermark = existing.get((user_id, chat_id, group_id))
+            if watermark is None:
+                created.append(cls(
+                    user_id=user_id, chat_id=chat_id, group_id=group_id,
+                    last_read_message_id=message_id, last_read_seq=seq, last_read_at=created_at
+                ))
+            elif watermark.last_read_seq < seq:
+                watermark.last_read_message_id = message_id
+                watermark.last_read_seq = seq
+                watermark.last_read_at = created_at
+                moved.append(watermark)
+        cls.objects.bulk_create(created, batch_size=1000)
+        cls.objects.bulk_update(moved, ['last_read_message', 'last_read_seq', 'last_read_at'], batch_size=1000)
+        return len(created) + len(moved)
+
+
+class ConversationEvent(models.Model):
+    """Append-only log of changes in chats and groups.
+    
+    Ids are taken inside the writing transaction, so events can commit out
+    of id order. The sync cursor is ``position`` instead, handed out after
+    commit in commit order by ``apps.messages.sync.publish_events``: a
+    reconnecting client asks for everything in its conversations after the
+    last position it saw. Events without a position are not served yet.
+    """
+    EVENT_TYPES = [
+        ('MESSAGE', 'New message'),
+        ('EDIT', 'Message edited'),
+        ('DELETE', 'Message deleted'),
+        ('REACTION_ADD', 'Reaction added'),
+        ('REACTION_REMOVE', 'Reaction removed'),
+        ('MEMBER_ADD', 'Member added'),
+        ('MEMBER_REMOVE', 'Member removed'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, null=True, blank=True, related_name='events')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='events')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, related_name='events')
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    payload = models.JSONField(default=dict, blank=True)
+    position = models.BigIntegerField(null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['chat', 'id']),
+            models.Index(fields=['group', 'id']),
+            models.Index(fields=['chat', 'position']),
+            models.Index(fields=['group', 'position']),
+            models.Index(fields=['id'], condition=models.Q(position__isnull=True), name='unpublished_event_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} #{self.id}"
+
+
+class EventSequence(models.Model):
+    """Single row holding the last ``ConversationEvent.position`` handed out.
+    
+    Publishers lock it, so positions are assigned and committed one batch
+    after another.
+    """
+    last_position = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Events published up to {self.last_position}"
+
+
+class ConversationSummary(models.Model):
+    """Per-user inbox row for a chat or group.
+    
+    Kept up to date as messages are inserted, edited, deleted and read (see
+    apps.messages.summaries), so the inbox is one indexed query. Also the
+    participant index: a user's chats and groups are found, and ordered by
+    activity, through their rows here.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_summaries')
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, null=True, blank=True, related_name='summaries')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='summaries')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    is_muted = models.BooleanField(default=False)
+    last_activity = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'chat'],
+                condition=models.Q(chat__isnull=False),
+                name='unique_chat_summary'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'group'],
+                condition=models.Q(group__isnull=False),
+                name='unique_group_summary'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_activity', '-id']),
+            models.Index(fields=['chat']),
+            models.Index(fields=['group']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.phone_number}: {self.unread_count} unread"
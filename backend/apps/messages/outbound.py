@@ -0,0 +1,122 @@
+"""Bounded per-connection outbound queue.
+
+Channel-layer handlers enqueue frames instead of writing to the socket, and
+a writer task per connection drains the queue. A client that cannot keep up
+fills its own queue (at most ``OUTBOUND_QUEUE_MAX_FRAMES``) rather than
+growing the worker's memory or stalling the channel layer. When the queue is
+full, ephemeral frames such as typing indicators are dropped first; if only
+durable frames are queued the connection is closed so the client resumes
+from its last sequence numbers or sync cursor. With
+``OUTBOUND_OVERFLOW_POLICY = 'close'`` the connection is closed right away.
+
+Metrics: ``outbound.queued_frames`` (gauge, all connections of the process),
+``outbound.queue_depth`` (peak depth of a single connection),
+``outbound.dropped_ephemeral`` and ``outbound.overflow_closes``.
+"""
+
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+from apps.messages import metrics
+
+# Channel-layer event types that may be dropped under backpressure
+EPHEMERAL_EVENT_TYPES = {'typing_indicator'}
+
+
+class OutboundQueue:
+    """Frames waiting to be written to one socket.
+
+    ``send`` is an async callable taking the keyword arguments of
+    ``AsyncWebsocketConsumer.send``. ``on_overflow`` is awaited by the writer
+    once a durable frame did not fit; nothing is sent after that.
+    ``delivered`` maps position keys to the last value written, see ``put``.
+    """
+
+    def __init__(self, send, on_overflow, max_frames=None, policy=None):
+        self.send = send
+        self.on_overflow = on_overflow
+        self.max_frames = max_frames or getattr(settings, 'OUTBOUND_QUEUE_MAX_FRAMES', 256)
+        self.policy = policy or getattr(settings, 'OUTBOUND_OVERFLOW_POLICY', 'drop_ephemeral')
+        self.frames = deque()
+        self.ephemeral = 0
+        self.delivered = {}
+        self.overflowed = False
+        self.ready = asyncio.Event()
+        self.writer = None
+
+    def start(self):
+        if self.writer is None:
+            self.writer = asyncio.ensure_future(self._drain())
+
+    async def stop(self):
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+        self._discard()
+
+    def put(self, frame, ephemeral=False, position=None):
+        """Queue a frame; returns False if it was dropped.
+
+        ``position`` is an optional ``(key, value)`` pair stored in
+        ``delivered`` once the frame has been written.
+        """
+        if self.overflowed:
+            return False
+        if len(self.frames) >= self.max_frames and not self._make_room(ephemeral):
+            return False
+
+        self.frames.append((frame, ephemeral, position))
+        self.ephemeral += ephemeral
+        metrics.gauge_add('outbound.queued_frames', 1)
+        metrics.observe_max('outbound.queue_depth', len(self.frames))
+        self.ready.set()
+        return True
+
+    def _make_room(self, ephemeral):
+        if self.policy == 'drop_ephemeral':
+            if ephemeral:
+                metrics.increment('outbound.dropped_ephemeral')
+                return False
+            if self.ephemeral:
+                self._evict_ephemeral()
+                metrics.increment('outbound.dropped_ephemeral')
+                return True
+
+        self.overflowed = True
+        self._discard()
+        metrics.increment('outbound.overflow_closes')
+        self.ready.set()
+        return False
+
+    def _evict_ephemeral(self):
+        for index, (_, ephemeral, _) in enumerate(self.frames):
+            if ephemeral:
+                del self.frames[index]
+                self.ephemeral -= 1
+                metrics.gauge_add('outbound.queued_frames', -1)
+                return
+
+    def _discard(self):
+        metrics.gauge_add('outbound.queued_frames', -len(self.frames))
+        self.frames.clear()
+        self.ephemeral = 0
+
+    async def _drain(self):
+        while True:
+            while self.frames:
+                frame, ephemeral, position = self.frames.popleft()
+                self.ephemeral -= ephemeral
+                metrics.gauge_add('outbound.queued_frames', -1)
+                await self.send(**frame)
+                if position is not None:
+                    self.delivered[position[0]] = position[1]
+
+            if self.overflowed:
+                self.writer = None
+                await self.on_overflow()
+                return
+
+            self.ready.clear()
+            await self.ready.wait()
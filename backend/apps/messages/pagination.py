@@ -0,0 +1,122 @@
+"""Keyset pagination of conversation history and conversation lists.
+
+Pages are ordered by ``(created_at, id)`` and continue from an opaque cursor
+holding the position of a message, so every page is a range scan on the
+``(conversation, created_at, id)`` index however far back it is, and
+messages arriving meanwhile do not shift or repeat pages. Lists of a user's
+conversations page the same way over ``(last_activity, id)`` of their
+``ConversationSummary`` rows.
+
+Query parameters:
+
+* ``before=<cursor>``: messages older than the cursor, newest first
+  (the default without a cursor is the newest page)
+* ``after=<cursor>``: messages newer than the cursor, oldest first
+* ``after_seq=<n>``: messages with ``seq`` above n, oldest first
+* ``limit``: page size, capped at ``MESSAGE_PAGE_SIZE_MAX``
+"""
+
+import base64
+import binascii
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db.models import Q
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+MessagePage = namedtuple('MessagePage', ['messages', 'has_more', 'before', 'after'])
+RecentPage = namedtuple('RecentPage', ['items', 'has_more', 'before'])
+
+
+def encode_position(at, row_id):
+    micros = (at - EPOCH) // timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(f'v1:{micros}:{row_id}'.encode()).decode().rstrip('=')
+
+
+def decode_position(cursor):
+    """Return ``(timestamp, id)``; raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        version, micros, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        if version != 'v1':
+            raise ValueError('Invalid cursor')
+        return EPOCH + timedelta(microseconds=int(micros)), uuid.UUID(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def encode_message_cursor(message):
+    return encode_position(message.created_at, message.id)
+
+
+def decode_message_cursor(cursor):
+    """Return ``(created_at, id)``; raises ValueError if malformed"""
+    return decode_position(cursor)
+
+
+def page_limit(value):
+    max_limit = getattr(settings, 'MESSAGE_PAGE_SIZE_MAX', 100)
+    return max(1, min(int(value or 50), max_limit))
+
+
+def paginate_messages(messages, params):
+    """Return a ``MessagePage`` of ``messages`` (one conversation) for the request params.
+
+    ``has_more`` tells whether more messages exist in the requested
+    direction. ``before`` and ``after`` are the cursors for the next older
+    and newer pages; ``before`` is None once history is exhausted.
+    """
+    limit = page_limit(params.get('limit'))
+
+    if params.get('after_seq') is not None:
+        rows = list(messages.filter(seq__gt=int(params['after_seq'])).order_by('seq')[:limit + 1])
+        forward = True
+    elif params.get('after'):
+        created_at, message_id = decode_message_cursor(params['after'])
+        rows = list(messages.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+        ).order_by('created_at', 'id')[:limit + 1])
+        forward = True
+    else:
+        if params.get('before'):
+            created_at, message_id = decode_message_cursor(params['before'])
+            messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+        rows = list(messages.order_by('-created_at', '-id')[:limit + 1])
+        forward = False
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return MessagePage(rows, False, None, params.get('after'))
+
+    oldest, newest = (rows[0], rows[-1]) if forward else (rows[-1], rows[0])
+    return MessagePage(
+        rows,
+        has_more,
+        encode_message_cursor(oldest) if forward or has_more else None,
+        encode_message_cursor(newest),
+    )
+
+
+def paginate_recent(rows, params, field='last_activity', id_field='id'):
+    """Return a ``RecentPage`` of ``rows``, most recent ``field`` first.
+
+    ``rows`` must be filtered to one user's conversations; ``before=<cursor>``
+    continues after the last row of the previous page, and ``before`` of the
+    result is None once the list is exhausted. ``id_field`` breaks ties; pass
+    the summary row's id when paging chats or groups through their
+    ``ConversationSummary`` so both sort keys come from its index.
+    """
+    limit = page_limit(params.get('limit'))
+    if params.get('before'):
+        at, row_id = decode_position(params['before'])
+        rows = rows.filter(Q(**{f'{field}__lt': at}) | Q(**{field: at, f'{id_field}__lt': row_id}))
+    items = list(rows.order_by(f'-{field}', f'-{id_field}')[:limit + 1])
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    before = encode_position(getattr(items[-1], field), getattr(items[-1], id_field)) if has_more else None
+    return RecentPage(items, has_more, before)
@@ -0,0 +1,270 @@
+"""Write-behind batching for messages arriving over WebSockets.
+
+Consumers hand unsaved ``Message`` instances to the buffer of their event
+loop. The buffer collects them for ``MESSAGE_WRITE_BUFFER_FLUSH_MS`` (or until
+``MESSAGE_WRITE_BUFFER_BATCH_SIZE`` are pending) and writes them with a single
+``bulk_create``. Ids are assigned on instantiation and ``created_at`` on insert,
+so each submitter gets back its message with the server values filled in.
+
+Messages may carry a ``client_msg_id`` chosen by the sending device. A retry
+with an id the sender already used resolves to the stored message instead
+of inserting a new one: recent ids are looked up in the cache
+(``CLIENT_MSG_ID_CACHE_TTL``), older ones in the database at write time, and
+a unique index on ``(sender, client_msg_id)`` settles concurrent inserts.
+"""
+
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+logger = logging.getLogger(__name__)
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+class MessageWriteBuffer:
+    """Per-event-loop buffer flushing pending messages with one bulk_create"""
+
+    def __init__(self, flush_interval_ms=None, batch_size=None):
+        if flush_interval_ms is None:
+            flush_interval_ms = getattr(settings, 'MESSAGE_WRITE_BUFFER_FLUSH_MS', 5)
+        if batch_size is None:
+            batch_size = getattr(settings, 'MESSAGE_WRITE_BUFFER_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.pending = []
+        self.timer = None
+
+    async def submit(self, message):
+        """Queue a message for insertion and wait until it has been written.
+
+        Returns the message, or the previously stored one if it repeats a
+        ``client_msg_id`` of its sender.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((message, future))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.flush_interval, self.flush)
+
+        return await future
+
+    def flush(self):
+        """Start writing everything pending; returns the flush task"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            return asyncio.ensure_future(self._flush(batch))
+
+    async def _flush(self, batch):
+        try:
+            results = await database_sync_to_async(self.write)([message for message, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (message, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def write(messages):
+        """Insert messages and their sync events in one transaction.
+
+        Returns one result per message: the message itself, the stored
+        message it duplicates, or the exception raised for it. Falls back to
+        row-by-row inserts if the batch fails, so one bad row does not fail
+        the rest of the batch.
+        """
+        try:
+            with transaction.atomic():
+                results, new = resolve_duplicates(messages)
+                insert_messages(new)
+            remember_client_messages(new)
+            return results
+        except Exception as e:
+            logger.warning(f"Batched insert of {len(messages)} messages failed, retrying one by one: {str(e)}")
+
+        results = []
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    (result,), new = resolve_duplicates([message])
+                    insert_messages(new)
+                remember_client_messages(new)
+                results.append(result)
+            except IntegrityError as e:
+                # Lost a race with a concurrent insert of the same client id
+                existing = find_client_message(message) if message.client_msg_id else None
+                results.append(existing or e)
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def save_message_now(message):
+    """Insert one message outside the buffer; returns ``(message, created)``"""
+    result, = MessageWriteBuffer.write([message])
+    if isinstance(result, Exception):
+        raise result
+    return result, result is message
+
+
+def insert_messages(messages):
+    """Number, insert and log messages and update inbox summaries; must run inside a transaction"""
+    from apps.messages.models import Message
+    from apps.messages.summaries import record_new_messages
+    from apps.messages.sync import record_message_events
+
+    if messages:
+        assign_sequence_numbers(messages)
+        Message.objects.bulk_create(messages)
+        record_message_events(messages)
+        record_new_messages(messages)
+
+
+def client_message_cache_key(sender_id, client_msg_id):
+    return f'client_msg:{sender_id}:{client_msg_id}'
+
+
+def get_cached_client_message(sender_id, client_msg_id):
+    """Return ``(message_id, seq)`` of a recently stored message, or None"""
+    return cache.get(client_message_cache_key(sender_id, client_msg_id))
+
+
+def remember_client_messages(messages):
+    entries = {
+        client_message_cache_key(message.sender_id, message.client_msg_id): (str(message.id), message.seq)
+        for message in messages if message.client_msg_id
+    }
+    if entries:
+        cache.set_many(entries, getattr(settings, 'CLIENT_MSG_ID_CACHE_TTL', 900))
+
+
+def find_client_message(message):
+    from apps.messages.models import Message
+
+    return Message.objects.filter(sender_id=message.sender_id, client_msg_id=message.client_msg_id).first()
+
+
+def resolve_duplicates(messages):
+    """Return ``(results, new)`` for a batch.
+
+    A message whose ``(sender, client_msg_id)`` is already stored, or used
+    earlier in the batch, resolves to that message; the others resolve to
+    themselves and are returned in ``new`` for insertion.
+    """
+    from apps.messages.models import Message
+
+    keyed = [message for message in messages if message.client_msg_id]
+    seen = {}
+    if keyed:
+        lookup = Q()
+        for message in keyed:
+            lookup |= Q(sender_id=message.sender_id, client_msg_id=message.client_msg_id)
+        seen = {(m.sender_id, m.client_msg_id): m for m in Message.objects.filter(lookup)}
+
+    results, new = [], []
+    for message in messages:
+        key = (message.sender_id, message.client_msg_id)
+        if message.client_msg_id and key in seen:
+            results.append(seen[key])
+            continue
+        if message.client_msg_id:
+            seen[key] = message
+        results.append(message)
+        new.append(message)
+    return results, new
+
+
+def assign_sequence_numbers(messages):
+    """Give each message the next ``seq`` of its chat or group.
+
+    Must run inside the transaction that inserts the messages. Each
+    conversation's counter row is locked and bumped once for all of its
+    messages in the batch, so the lock is taken once per batch rather than
+    once per message; rows are locked in a fixed order to avoid deadlocks.
+    """
+    from apps.messages.models import Chat, Group
+
+    by_conversation = defaultdict(list)
+    for message in messages:
+        if message.chat_id:
+            by_conversation[(Chat, str(message.chat_id))].append(message)
+        else:
+            by_conversation[(Group, str(message.group_id))].append(message)
+
+    for (model, conversation_id), batch in sorted(by_conversation.items(), key=lambda item: (item[0][0].__name__, item[0][1])):
+        last_seq = model.objects.select_for_update().values_list('last_seq', flat=True).get(id=conversation_id)
+        model.objects.filter(id=conversation_id).update(last_seq=last_seq + len(batch))
+        for offset, message in enumerate(batch, start=1):
+            message.seq = last_seq + offset
+
+
+def backfill_sequence_numbers(model):
+    """Number the messages of every ``model`` (Chat or Group) still holding unnumbered ones.
+
+    Messages get ``1..n`` in ``(created_at, id)`` order, the conversation's
+    ``last_seq`` becomes ``n`` and read watermarks are moved onto the new
+    numbers of their last read message, or of the newest message sent by
+    their ``last_read_at`` when that message is gone. Conversations are renumbered whole,
+    so messages numbered after the upgrade keep their relative order behind
+    the older ones. Each conversation is locked like ``assign_sequence_numbers``
+    does and done in its own transaction. Returns the number of conversations
+    renumbered.
+    """
+    from apps.messages.models import Message, ReadWatermark
+
+    field = f'{model.__name__.lower()}_id'
+    conversation_ids = Message.objects.filter(
+        seq__isnull=True, **{f'{field}__isnull': False}
+    ).values_list(field, flat=True).distinct()
+
+    renumbered = 0
+    for conversation_id in list(conversation_ids):
+        with transaction.atomic():
+            model.objects.select_for_update().filter(id=conversation_id).first()
+            messages = Message.objects.filter(**{field: conversation_id})
+            ordered = list(messages.order_by('created_at', 'id').only('id'))
+            # Clear first so the new numbers never collide with old ones under the unique constraint
+            messages.update(seq=None)
+            for seq, message in enumerate(ordered, start=1):
+                message.seq = seq
+            Message.objects.bulk_update(ordered, ['seq'], batch_size=1000)
+            model.objects.filter(id=conversation_id).update(last_seq=len(ordered))
+            ReadWatermark.objects.filter(**{field: conversation_id}).update(
+                last_read_seq=Coalesce(
+                    Subquery(Message.objects.filter(id=OuterRef('last_read_message_id')).values('seq')[:1]),
+                    # The last read message may have been deleted since
+                    Subquery(messages.filter(created_at__lte=OuterRef('last_read_at')).order_by('-seq').values('seq')[:1]),
+                    0
+                )
+            )
+        renumbered += 1
+    return renumbered
+
+
+def get_write_buffer():
+    """Return the write buffer bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageWriteBuffer()
+    return buffer
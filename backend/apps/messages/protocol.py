@@ -0,0 +1,165 @@
+"""Wire encodings for the messaging WebSockets.
+
+JSON text frames are the default. Clients that offer the
+``whatsapp.msgpack.v1`` subprotocol get binary MessagePack frames instead:
+
+* keys are replaced by the small integer ids in ``FIELD_IDS``
+* ``type`` values are replaced by the ids in ``TYPE_IDS``
+* UUID fields travel as 16 raw bytes
+* timestamp fields use the MessagePack timestamp extension
+
+Keys and types missing from the tables are sent unchanged, so new fields
+work before a client knows their id. ``msgpack`` is optional; without it
+only JSON is offered.
+"""
+
+import json
+import uuid
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = 'whatsapp.msgpack.v1'
+
+# Never renumber: ids are part of the wire format. Append new ones only.
+FIELD_IDS = {
+    'type': 0,
+    'conversation_type': 1,
+    'conversation_id': 2,
+    'message_id': 3,
+    'sender_id': 4,
+    'sender_name': 5,
+    'content': 6,
+    'message_type': 7,
+    'created_at': 8,
+    'user_id': 9,
+    'user_name': 10,
+    'is_typing': 11,
+    'reader_id': 12,
+    'reader_name': 13,
+    'read_at': 14,
+    'new_content': 15,
+    'edited_at': 16,
+    'mode': 17,
+    'emoji': 18,
+    'error': 19,
+    'seq': 20,
+    'frame_type': 21,
+    'retry_after': 22,
+    'client_msg_id': 23,
+}
+
+TYPE_IDS = {
+    # Client -> server
+    'text_message': 1,
+    'typing': 2,
+    'read_receipt': 3,
+    'message_edit': 4,
+    'message_delete': 5,
+    'reaction_add': 6,
+    'reaction_remove': 7,
+    'heartbeat': 8,
+    # Server -> client
+    'text_message_received': 16,
+    'message_edited': 17,
+    'message_deleted': 18,
+    'reaction_added': 19,
+    'reaction_removed': 20,
+    'conversation_added': 21,
+    'conversation_removed': 22,
+    'heartbeat_ack': 23,
+    'resume': 24,
+    'throttled': 25,
+    'message_ack': 26,
+}
+
+UUID_FIELDS = {'conversation_id', 'message_id', 'sender_id', 'user_id', 'reader_id'}
+TIMESTAMP_FIELDS = {'created_at', 'read_at', 'edited_at'}
+
+FIELD_NAMES = {v: k for k, v in FIELD_IDS.items()}
+TYPE_NAMES = {v: k for k, v in TYPE_IDS.items()}
+
+
+class JSONCodec:
+    """Plain JSON text frames"""
+    subprotocol = None
+
+    def encode(self, payload):
+        """Return the ``send()`` keyword arguments for a payload"""
+        return {'text_data': json.dumps(payload)}
+
+    def forward(self, frames):
+        """Return the ``send()`` keyword arguments for frames from ``encode_frames``"""
+        return {'text_data': frames['text']}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MessagePackCodec(JSONCodec):
+    """Binary MessagePack frames with compact keys, UUIDs and timestamps"""
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, payload):
+        return {'bytes_data': msgpack.packb(compact(payload), datetime=True)}
+
+    def forward(self, frames):
+        if 'bytes' not in frames:
+            # Encoded by a process without msgpack
+            return self.encode(json.loads(frames['text']))
+        return {'bytes_data': frames['bytes']}
+
+    def decode(self, text_data=None, bytes_data=None):
+        # Text frames stay valid JSON even on a MessagePack connection
+        if bytes_data is None:
+            return super().decode(text_data=text_data)
+        return expand(msgpack.unpackb(bytes_data, strict_map_key=False, timestamp=3))
+
+
+def compact(payload):
+    frame = {}
+    for key, value in payload.items():
+        if key == 'type':
+            value = TYPE_IDS.get(value, value)
+        elif value is not None and key in UUID_FIELDS:
+            value = uuid.UUID(str(value)).bytes
+        elif isinstance(value, str) and key in TIMESTAMP_FIELDS:
+            value = datetime.fromisoformat(value)
+        frame[FIELD_IDS.get(key, key)] = value
+    return frame
+
+
+def expand(frame):
+    payload = {}
+    for key, value in frame.items():
+        key = FIELD_NAMES.get(key, key)
+        if key == 'type':
+            value = TYPE_NAMES.get(value, value)
+        elif isinstance(value, bytes) and key in UUID_FIELDS:
+            value = str(uuid.UUID(bytes=value))
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        payload[key] = value
+    return payload
+
+
+def encode_frames(payload):
+    """Encode a payload once in every available wire format.
+
+    Broadcasts carry the result so each receiving consumer forwards the
+    bytes for its negotiated codec instead of re-serializing the payload.
+    """
+    frames = {'text': json.dumps(payload)}
+    if msgpack is not None:
+        frames['bytes'] = msgpack.packb(compact(payload), datetime=True)
+    return frames
+
+
+def negotiate(subprotocols):
+    """Pick the codec for the subprotocols a client offered"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in (subprotocols or ()):
+        return MessagePackCodec()
+    return JSONCodec()
@@ -0,0 +1,116 @@
+"""Per-connection rate limiting of client frames.
+
+Each connection has one token bucket per event class. Limits are configured
+in ``WS_RATE_LIMITS`` as ``'<tokens per second>/<burst>'`` strings. Frames
+over the limit are dropped before they reach the database or the channel
+layer; the client is told once per burst with a ``throttled`` frame.
+
+Typing frames are not checked per frame: clients send one per keystroke
+and ``TypingCoalescer`` absorbs them, charging the ``typing`` budget only
+for the "started typing" changes it would publish (see ``allow``). A
+"stopped typing" frame is never throttled.
+"""
+
+import time
+
+from django.conf import settings
+
+from apps.messages import metrics
+
+# Client frame type -> event class sharing one budget
+FRAME_CLASSES = {
+    'text_message': 'messages',
+    'message_edit': 'messages',
+    'message_delete': 'messages',
+    'reaction_add': 'reactions',
+    'reaction_remove': 'reactions',
+    'read_receipt': 'receipts',
+    'heartbeat': 'heartbeat',
+}
+
+DEFAULT_RATE_LIMITS = {
+    'messages': '5/20',
+    'reactions': '5/20',
+    'typing': '2/10',
+    'receipts': '10/50',
+    'heartbeat': '1/5',
+}
+
+
+def parse_limit(limit):
+    rate, _, burst = str(limit).partition('/')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'throttled')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.throttled = False
+
+    def consume(self):
+        """Take a token if one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        return round((1 - self.tokens) / self.rate, 3) if self.rate else None
+
+
+class FrameRateLimiter:
+    """Token buckets of one connection, created lazily per event class"""
+
+    def __init__(self, limits=None):
+        configured = limits if limits is not None else getattr(settings, 'WS_RATE_LIMITS', DEFAULT_RATE_LIMITS)
+        self.limits = {name: parse_limit(limit) for name, limit in configured.items()}
+        self.buckets = {}
+
+    def check(self, frame_type):
+        """Return ``(allowed, notify)`` for a frame.
+
+        ``notify`` is True for the first rejected frame after a run of
+        allowed ones, so a flooding client gets one reply rather than one
+        per frame.
+        """
+        event_class = FRAME_CLASSES.get(frame_type)
+        if event_class not in self.limits:
+            return True, False
+
+        bucket = self.bucket(event_class)
+        if bucket.consume():
+            bucket.throttled = False
+            return True, False
+
+        metrics.increment(f'ratelimit.throttled.{event_class}')
+        notify = not bucket.throttled
+        bucket.throttled = True
+        return False, notify
+
+    def allow(self, event_class):
+        """Take a token from an event class's budget without telling the client"""
+        if event_class not in self.limits:
+            return True
+        if self.bucket(event_class).consume():
+            return True
+        metrics.increment(f'ratelimit.throttled.{event_class}')
+        return False
+
+    def bucket(self, event_class):
+        bucket = self.buckets.get(event_class)
+        if bucket is None:
+            bucket = self.buckets[event_class] = TokenBucket(*self.limits[event_class])
+        return bucket
+
+    def retry_after(self, frame_type):
+        bucket = self.buckets.get(FRAME_CLASSES.get(frame_type))
+        return bucket.retry_after() if bucket is not None else None
@@ -0,0 +1,50 @@
+"""Versioned group rosters.
+
+Group lists only carry ``member_count`` and ``roster_version``; the member
+list with profiles is served by the roster endpoint. Rendered rosters are
+cached under ``roster:group:<id>:v<version>``, and any change to who is in a
+group or to a member's profile bumps ``Group.roster_version`` instead of
+deleting entries, so stale rosters are simply never read again and expire
+after ``ROSTER_CACHE_TTL``. Clients keep their copy and revalidate it with
+``If-None-Match`` against the ``"roster-<id>-<version>"`` ETag.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from apps.messages.models import Group, GroupMember
+
+
+def roster_cache_key(group_id, version):
+    return f'roster:group:{group_id}:v{version}'
+
+
+def roster_etag(group_id, version):
+    return f'"roster-{group_id}-{version}"'
+
+
+def get_roster(group):
+    """Serialized current members of ``group`` at its ``roster_version``"""
+    from apps.messages.serializers import GroupMemberSerializer
+
+    key = roster_cache_key(group.id, group.roster_version)
+    roster = cache.get(key)
+    if roster is None:
+        members = GroupMember.objects.filter(group=group, left_at__isnull=True).select_related('user').order_by('joined_at')
+        roster = list(GroupMemberSerializer(members, many=True).data)
+        cache.set(key, roster, getattr(settings, 'ROSTER_CACHE_TTL', 3600))
+    return roster
+
+
+def bump_roster_version(group):
+    """Call after members join, leave or change role"""
+    Group.objects.filter(id=group.id).update(roster_version=F('roster_version') + 1)
+    group.roster_version += 1
+
+
+def bump_member_rosters(user_id):
+    """Call after a user's profile changes; every group they are in shows it"""
+    Group.objects.filter(
+        id__in=GroupMember.objects.filter(user_id=user_id, left_at__isnull=True).values('group_id')
+    ).update(roster_version=F('roster_version') + 1)
@@ -1,7 +1,8 @@
 from django.urls import path
-from apps.messages.consumers import ChatConsumer, GroupConsumer
+from apps.messages.consumers import ChatConsumer, GroupConsumer, UserConsumer
 
 websocket_urlpatterns = [
+    path('ws/user/', UserConsumer.as_asgi()),
     path('ws/chat/<uuid:chat_id>/', ChatConsumer.as_asgi()),
     path('ws/group/<uuid:group_id>/', GroupConsumer.as_asgi()),
 ]
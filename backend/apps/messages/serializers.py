@@ -1,5 +1,9 @@
+from django.db.models import F
 from rest_framework import serializers
-from apps.messages.models import Chat, Group, GroupMember, Message, MessageReaction, ReadReceipt
+from apps.messages.models import (
+    Chat, Group, GroupMember, Message, MessageReaction, ReadReceipt, ReadWatermark,
+    ConversationEvent, ConversationSummary, conversation_of
+)
 
 class ChatSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,16 +13,19 @@ class ChatSerializer(serializers.ModelSerializer):
 
 
 class GroupSerializer(serializers.ModelSerializer):
-    members = serializers.SerializerMethodField()
+    """Group without its members; rosters are served by the roster endpoint"""
+    member_count = serializers.SerializerMethodField()
     
-    def get_members(self, obj):
-        members = obj.members.filter(left_at__isnull=True)
-        return GroupMemberSerializer(members, many=True).data
+    def get_member_count(self, obj):
+        if hasattr(obj, 'member_count'):
+            return obj.member_count
+        return obj.members.filter(left_at__isnull=True).count()
     
     class Meta:
         model = Group
-        fields = ['id', 'name', 'group_picture_url', 'description', 'created_by', 'members', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'group_picture_url', 'description', 'created_by', 'member_count', 'roster_version',
+                  'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_by', 'roster_version', 'created_at', 'updated_at']
 
 
 class GroupMemberSerializer(serializers.ModelSerializer):
@@ -48,17 +55,90 @@ class ReadReceiptSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'read_at']
 
 
+class ReadWatermarkReceiptSerializer(serializers.ModelSerializer):
+    """Presents a read watermark in the shape of a ReadReceipt"""
+    read_at = serializers.DateTimeField(source='updated_at', read_only=True)
+    
+    class Meta:
+        model = ReadWatermark
+        fields = ['id', 'user', 'read_at']
+        read_only_fields = fields
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    reactions = MessageReactionSerializer(many=True, read_only=True)
-    read_receipts = ReadReceiptSerializer(many=True, read_only=True)
+    """Message with reaction counts and read receipts.
+    
+    Read receipts are derived from the conversation's read watermarks. Pass
+    them as ``context['read_watermarks']`` when serializing a page of one
+    conversation to load them once instead of once per message. Likewise
+    ``context['own_reactions']`` maps message ids to the caller's emojis;
+    prefetch ``reaction_counts`` for pages.
+    """
+    reaction_counts = serializers.SerializerMethodField()
+    my_reactions = serializers.SerializerMethodField()
+    read_receipts = serializers.SerializerMethodField()
     sender_name = serializers.CharField(source='sender.name', read_only=True)
     
+    def get_reaction_counts(self, obj):
+        return {r.emoji: r.count for r in obj.reaction_counts.all()}
+    
+    def get_my_reactions(self, obj):
+        own_reactions = self.context.get('own_reactions')
+        if own_reactions is not None:
+            return own_reactions.get(obj.id, [])
+        request = self.context.get('request')
+        if request is None:
+            return []
+        return list(obj.reactions.filter(user=request.user).values_list('emoji', flat=True))
+    
+    def get_read_receipts(self, obj):
+        if obj.seq is None:
+            return []
+        watermarks = self.context.get('read_watermarks')
+        if watermarks is None:
+            watermarks = ReadWatermark.objects.filter(chat_id=obj.chat_id, group_id=obj.group_id)
+        readers = [
+            w for w in watermarks
+            if w.last_read_seq >= obj.seq and w.user_id != obj.sender_id
+        ]
+        return ReadWatermarkReceiptSerializer(readers, many=True).data
+    
     class Meta:
         model = Message
-        fields = ['id', 'chat', 'group', 'sender', 'sender_name', 'content', 'message_type', 
+        fields = ['id', 'chat', 'group', 'seq', 'client_msg_id', 'sender', 'sender_name', 'content', 'message_type', 
                   'is_deleted', 'deleted_by_sender_only', 'forwarded_from', 'edited_at', 
-                  'created_at', 'reactions', 'read_receipts']
-        read_only_fields = ['id', 'sender', 'created_at', 'read_receipts']
+                  'created_at', 'reaction_counts', 'my_reactions', 'read_receipts']
+        read_only_fields = ['id', 'seq', 'client_msg_id', 'sender', 'created_at', 'read_receipts']
+
+
+class MessageRowSerializer(MessageSerializer):
+    """Lean MessageSerializer for pages of one conversation.
+    
+    Rows must come from ``prepare_queryset`` and the context must hold
+    ``read_receipts`` (``(last_read_seq, user_id, data)`` tuples, furthest
+    read first) and ``own_reactions``, so a page costs the same number of
+    queries however many messages it holds. Messages not numbered yet show
+    no receipts.
+    """
+    sender_name = serializers.CharField(read_only=True)
+    
+    @staticmethod
+    def prepare_queryset(messages):
+        return messages.annotate(sender_name=F('sender__name')).prefetch_related('reaction_counts')
+    
+    def get_read_receipts(self, obj):
+        if obj.seq is None:
+            return []
+        receipts = []
+        for last_read_seq, user_id, data in self.context['read_receipts']:
+            if last_read_seq < obj.seq:
+                break
+            if user_id != obj.sender_id:
+                receipts.append(data)
+        return receipts
+    
+    def get_my_reactions(self, obj):
+        return self.context['own_reactions'].get(obj.id, [])
 
 
 class CreateMessageSerializer(serializers.Serializer):
@@ -67,3 +147,87 @@ class CreateMessageSerializer(serializers.Serializer):
     group_id = serializers.UUIDField(required=False, allow_null=True)
     content = serializers.CharField(max_length=5000)
     message_type = serializers.ChoiceField(choices=['TEXT', 'IMAGE', 'VIDEO', 'FILE', 'AUDIO'])
+    client_msg_id = serializers.CharField(max_length=64, required=False, allow_null=True)
+
+
+class GroupMembersSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=True)
+
+
+class ReadTargetSerializer(serializers.Serializer):
+    conversation_type = serializers.ChoiceField(choices=['chat', 'group'])
+    conversation_id = serializers.UUIDField()
+    message_id = serializers.UUIDField(required=False)
+
+
+class BulkReadSerializer(serializers.Serializer):
+    all = serializers.BooleanField(default=False)
+    conversations = ReadTargetSerializer(many=True, required=False)
+    
+    def validate(self, data):
+        if not data['all'] and not data.get('conversations'):
+            raise serializers.ValidationError('Set all or list conversations')
+        return data
+
+
+class SyncMessageSerializer(serializers.ModelSerializer):
+    """Message fields carried by sync events"""
+    sender_name = serializers.CharField(source='sender.name', read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'chat', 'group', 'seq', 'client_msg_id', 'sender', 'sender_name', 'content', 'message_type',
+                  'is_deleted', 'deleted_by_sender_only', 'forwarded_from', 'edited_at', 'created_at']
+        read_only_fields = fields
+
+
+class ConversationEventSerializer(serializers.ModelSerializer):
+    conversation_type = serializers.SerializerMethodField()
+    conversation_id = serializers.SerializerMethodField()
+    message = SyncMessageSerializer(read_only=True)
+    
+    def get_conversation_type(self, obj):
+        return conversation_of(obj)[0]
+    
+    def get_conversation_id(self, obj):
+        return str(obj.chat_id or obj.group_id)
+    
+    class Meta:
+        model = ConversationEvent
+        fields = ['event_type', 'conversation_type', 'conversation_id', 'message', 'actor', 'payload', 'created_at']
+        read_only_fields = fields
+
+
+class ConversationSummarySerializer(serializers.ModelSerializer):
+    """Inbox row; expects chat users, group and last sender to be selected"""
+    conversation_type = serializers.SerializerMethodField()
+    conversation_id = serializers.SerializerMethodField()
+    title = serializers.SerializerMethodField()
+    picture_url = serializers.SerializerMethodField()
+    last_message_sender_name = serializers.CharField(source='last_message_sender.name', default=None, read_only=True)
+    
+    def get_conversation_type(self, obj):
+        return conversation_of(obj)[0]
+    
+    def get_conversation_id(self, obj):
+        return str(obj.chat_id or obj.group_id)
+    
+    def other_user(self, obj):
+        return obj.chat.user2 if obj.chat.user1_id == obj.user_id else obj.chat.user1
+    
+    def get_title(self, obj):
+        if obj.group_id:
+            return obj.group.name
+        return self.other_user(obj).name
+    
+    def get_picture_url(self, obj):
+        if obj.group_id:
+            return obj.group.group_picture_url
+        return self.other_user(obj).profile_picture_url
+    
+    class Meta:
+        model = ConversationSummary
+        fields = ['conversation_type', 'conversation_id', 'title', 'picture_url', 'last_message',
+                  'last_message_preview', 'last_message_sender', 'last_message_sender_name', 'last_message_at',
+                  'unread_count', 'is_muted', 'last_activity']
+        read_only_fields = fields
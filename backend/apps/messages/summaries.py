@@ -0,0 +1,266 @@
+"""Per-user conversation summaries backing the inbox.
+
+Every participant of a chat or group has one ``ConversationSummary`` row with
+the conversation's last message and the participant's unread count, so the
+inbox is a single range scan on ``(user, -last_activity)`` instead of a
+message query per conversation.
+
+Rows are created when someone joins a conversation and deleted when they
+leave. ``record_new_messages`` updates them in the transaction that inserts
+messages, with one UPDATE per conversation per batch; ``mark_read`` recounts
+only the messages after the reader's new watermark, or none when they read
+the last message. ``rebuild`` recomputes everything from the source tables
+and ``repair_unread`` only the counters.
+
+The per-user totals behind the app badge are cached and dropped whenever one
+of the user's summaries changes, so a badge request is a cache hit or one
+aggregate over the user's own rows.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+
+from apps.messages.membership import get_member_ids
+from apps.messages.models import (
+    Chat, ConversationSummary, GroupMember, Message, ReadWatermark, conversation_filter, conversation_of
+)
+
+PREVIEW_LENGTH = 100
+
+
+def preview(message):
+    """Inbox snippet for a message"""
+    if message.is_deleted:
+        return ''
+    if message.message_type == 'TEXT':
+        return message.content[:PREVIEW_LENGTH]
+    return f'[{message.get_message_type_display()}]'
+
+
+def last_message_fields(message):
+    if message is None:
+        return {}
+    return {
+        'last_message': message,
+        'last_message_preview': preview(message),
+        'last_message_sender_id': message.sender_id,
+        'last_message_at': message.created_at,
+        'last_activity': message.created_at,
+    }
+
+
+def latest_message(kind, conversation_id):
+    return Message.objects.filter(**conversation_filter(kind, conversation_id)).order_by('-created_at', '-id').first()
+
+
+def unread_cache_key(user_id):
+    return f'unread:user:{user_id}'
+
+
+def invalidate_unread(user_ids):
+    """Drop cached unread totals once the surrounding transaction commits"""
+    keys = [unread_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_unread_totals(user_id):
+    """Return ``(unread messages, conversations with unread messages)``, muted conversations excluded"""
+    key = unread_cache_key(user_id)
+    totals = cache.get(key)
+    if totals is None:
+        row = ConversationSummary.objects.filter(user_id=user_id, is_muted=False, unread_count__gt=0).aggregate(
+            messages=Sum('unread_count'),
+            conversations=Count('id')
+        )
+        totals = (row['messages'] or 0, row['conversations'])
+        cache.set(key, totals, getattr(settings, 'UNREAD_CACHE_TTL', 300))
+    return totals
+
+
+def add_participants(kind, conversation_id, user_ids):
+    """Create summary rows for users joining a conversation; existing rows are kept"""
+    user_ids = list(user_ids)
+    fields = last_message_fields(latest_message(kind, conversation_id))
+    ConversationSummary.objects.bulk_create([
+        ConversationSummary(user_id=user_id, **conversation_filter(kind, conversation_id), **fields)
+        for user_id in user_ids
+    ], ignore_conflicts=True)
+    invalidate_unread(user_ids)
+
+
+def remove_participants(kind, conversation_id, user_ids):
+    user_ids = list(user_ids)
+    ConversationSummary.objects.filter(
+        user_id__in=user_ids, **conversation_filter(kind, conversation_id)
+    ).delete()
+    invalidate_unread(user_ids)
+
+
+def set_muted(user_id, kind, conversation_id, muted):
+    """Returns False if the user is not in the conversation"""
+    if not ConversationSummary.objects.filter(
+        user_id=user_id, **conversation_filter(kind, conversation_id)
+    ).update(is_muted=muted):
+        return False
+    invalidate_unread([user_id])
+    return True
+
+
+def record_new_messages(messages):
+    """Move each conversation's summaries to the newest message of a batch.
+
+    Every participant's unread count grows by the messages in the batch sent
+    by someone else. Must run in the transaction that inserts the messages.
+    """
+    by_conversation = {}
+    for message in messages:
+        by_conversation.setdefault(conversation_of(message), []).append(message)
+
+    for (kind, conversation_id), batch in by_conversation.items():
+        sent = {}
+        for message in batch:
+            sent[message.sender_id] = sent.get(message.sender_id, 0) + 1
+        ConversationSummary.objects.filter(**conversation_filter(kind, conversation_id)).update(
+            unread_count=F('unread_count') + len(batch) - Case(
+                *[When(user_id=sender_id, then=Value(count)) for sender_id, count in sent.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            ),
+            **last_message_fields(max(batch, key=lambda message: message.seq))
+        )
+        invalidate_unread(get_member_ids(kind, conversation_id))
+
+
+def refresh_preview(message):
+    """Update the snippet after the last message of a conversation is edited or deleted"""
+    ConversationSummary.objects.filter(last_message_id=message.id).update(last_message_preview=preview(message))
+
+
+def count_unread(user_id, kind, conversation_id, read_seq=0):
+    messages = Message.objects.filter(**conversation_filter(kind, conversation_id)).exclude(sender_id=user_id)
+    if read_seq:
+        messages = messages.filter(seq__gt=read_seq)
+    return messages.count()
+
+
+def mark_read(user, message):
+    """Advance the user's read watermark to ``message`` and update their unread count.
+
+    Reading the conversation's last message resets the count; reading an
+    older one recounts the messages after it, unless it is not numbered yet. Returns True if the
+    watermark moved, like ``ReadWatermark.advance``.
+    """
+    kind, conversation_id = conversation_of(message)
+    with transaction.atomic():
+        if not ReadWatermark.advance(user, message):
+            return False
+        summaries = ConversationSummary.objects.filter(user=user, **conversation_filter(kind, conversation_id))
+        if not summaries.filter(last_message_id=message.id).update(unread_count=0) and message.seq is not None:
+            summaries.update(unread_count=count_unread(user.id, kind, conversation_id, message.seq))
+        invalidate_unread([user.id])
+    return True
+
+
+def read_conversations(user, targets=None):
+    """Mark several conversations read; returns how many watermarks moved.
+
+    ``targets`` lists ``(kind, conversation_id, message_id)`` tuples, read up
+    to the message or, when ``message_id`` is None, to the last message.
+    Conversations the user is not in are skipped. Without targets every
+    conversation with unread messages is read to its end.
+    """
+    summaries = ConversationSummary.objects.filter(user=user, last_message__isnull=False)
+    if targets is None:
+        return sum(mark_read(user, summary.last_message) for summary in summaries.filter(
+            unread_count__gt=0
+        ).select_related('last_message'))
+
+    moved = 0
+    for kind, conversation_id, message_id in targets:
+        conversation = conversation_filter(kind, conversation_id)
+        if message_id is None:
+            summary = summaries.filter(**conversation).select_related('last_message').first()
+            message = summary.last_message if summary else None
+        elif summaries.filter(**conversation).exists():
+            message = Message.objects.only('id', 'chat_id', 'group_id', 'seq', 'created_at').filter(
+                id=message_id, **conversation
+            ).first()
+        else:
+            message = None
+        if message is not None:
+            moved += mark_read(user, message)
+    return moved
+
+
+def get_inbox(user):
+    """The user's conversations, most recently active first"""
+    return ConversationSummary.objects.filter(user=user).select_related(
+        'chat__user1', 'chat__user2', 'group', 'last_message_sender'
+    ).order_by('-last_activity', '-id')
+
+
+def rebuild(user_ids=None):
+    """Recompute summaries from chats, memberships, messages and read watermarks"""
+    summaries = ConversationSummary.objects.all()
+    chats = Chat.objects.all()
+    members = GroupMember.objects.filter(left_at__isnull=True)
+    if user_ids is not None:
+        user_ids = {str(user_id) for user_id in user_ids}
+        summaries = summaries.filter(user_id__in=user_ids)
+        chats = chats.filter(user1_id__in=user_ids) | chats.filter(user2_id__in=user_ids)
+        members = members.filter(user_id__in=user_ids)
+
+    muted = set(summaries.filter(is_muted=True).values_list('user_id', 'chat_id', 'group_id'))
+    affected = set(summaries.values_list('user_id', flat=True))
+    summaries.delete()
+
+    participants = []
+    for chat_id, user1_id, user2_id in chats.values_list('id', 'user1_id', 'user2_id'):
+        participants += [(user_id, 'chat', chat_id) for user_id in (user1_id, user2_id)
+                         if user_ids is None or str(user_id) in user_ids]
+    participants += [(user_id, 'group', group_id) for user_id, group_id in members.values_list('user_id', 'group_id')]
+
+    watermarks = {
+        (user_id, chat_id or group_id): read_seq
+        for user_id, chat_id, group_id, read_seq in ReadWatermark.objects.values_list(
+            'user_id', 'chat_id', 'group_id', 'last_read_seq'
+        )
+    }
+    latest = {}
+    rows = []
+    for user_id, kind, conversation_id in participants:
+        if (kind, conversation_id) not in latest:
+            latest[(kind, conversation_id)] = latest_message(kind, conversation_id)
+        key = (user_id, conversation_id, None) if kind == 'chat' else (user_id, None, conversation_id)
+        rows.append(ConversationSummary(
+            user_id=user_id,
+            unread_count=count_unread(user_id, kind, conversation_id, watermarks.get((user_id, conversation_id), 0)),
+            is_muted=key in muted,
+            **conversation_filter(kind, conversation_id),
+            **last_message_fields(latest[(kind, conversation_id)])
+        ))
+    ConversationSummary.objects.bulk_create(rows, batch_size=1000)
+    invalidate_unread(affected | {row.user_id for row in rows})
+
+
+def repair_unread(user_ids=None):
+    """Recount unread messages from messages and read watermarks; returns the number of counters fixed"""
+    summaries = ConversationSummary.objects.all()
+    if user_ids is not None:
+        summaries = summaries.filter(user_id__in=list(user_ids))
+
+    fixed = []
+    for summary in summaries.only('id', 'user_id', 'chat_id', 'group_id', 'unread_count').iterator():
+        kind, conversation_id = conversation_of(summary)
+        read_seq = ReadWatermark.objects.filter(
+            user_id=summary.user_id, **conversation_filter(kind, conversation_id)
+        ).values_list('last_read_seq', flat=True).first()
+        unread = count_unread(summary.user_id, kind, conversation_id, read_seq or 0)
+        if unread != summary.unread_count:
+            ConversationSummary.objects.filter(id=summary.id).update(unread_count=unread)
+            fixed.append(summary.user_id)
+    invalidate_unread(set(fixed))
+    return len(fixed)
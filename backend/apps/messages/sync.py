@@ -0,0 +1,151 @@
+"""Change log recording and cursor-based delta sync.
+
+Every change a reconnecting client needs to replay (new messages, edits,
+deletions, reactions, membership changes) is appended to
+``ConversationEvent``. ``fetch_changes`` returns the events of a user's
+conversations after an opaque cursor, oldest first, in bounded pages.
+
+Cursors are event positions rather than ids. Ids are taken inside the
+writing transactions, and writes to different conversations commit in any
+order, so a client that had seen id 11 could miss id 10 committing after it.
+``publish_events`` numbers committed events after the fact under one lock,
+so a client that has seen a position has seen every lower one.
+"""
+
+import base64
+import binascii
+
+from django.conf import settings
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
+
+from apps.messages.models import (
+    ConversationEvent, ConversationSummary, EventSequence, GroupMember, conversation_filter, conversation_of
+)
+
+
+def record_event(event_type, message=None, actor=None, chat_id=None, group_id=None, **payload):
+    """Append one event; the conversation is taken from ``message`` if given"""
+    conversation = conversation_filter(*conversation_of(message)) if message is not None else {'chat_id': chat_id, 'group_id': group_id}
+    return ConversationEvent.objects.create(
+        event_type=event_type,
+        message=message,
+        actor=actor,
+        payload=payload,
+        **conversation
+    )
+
+
+def record_message_events(messages):
+    """Append MESSAGE events for newly inserted messages in one statement"""
+    ConversationEvent.objects.bulk_create([
+        ConversationEvent(
+            event_type='MESSAGE',
+            message=message,
+            actor_id=message.sender_id,
+            **conversation_filter(*conversation_of(message))
+        )
+        for message in messages
+    ])
+
+
+def record_membership_events(event_type, group_id, user_ids, actor=None):
+    """One event for all users joining or leaving a group in one change"""
+    return ConversationEvent.objects.create(
+        event_type=event_type,
+        group_id=group_id,
+        actor=actor,
+        payload={'user_ids': [str(user_id) for user_id in user_ids]}
+    )
+
+
+def publish_events():
+    """Give committed events without a position the next positions, in id order.
+    
+    Positions are handed out under a lock on the ``EventSequence`` row and
+    become visible when that transaction commits, one batch after another.
+    Returns at once if another request is already publishing; its batch
+    shows up on the next sync.
+    """
+    if not ConversationEvent.objects.filter(position__isnull=True).exists():
+        return
+    EventSequence.objects.get_or_create(id=1)
+    with transaction.atomic():
+        sequence = EventSequence.objects.select_for_update(skip_locked=True).filter(id=1).first()
+        if sequence is None:
+            return
+        pending = list(ConversationEvent.objects.filter(position__isnull=True).order_by('id').only('id'))
+        for offset, event in enumerate(pending, start=1):
+            event.position = sequence.last_position + offset
+        ConversationEvent.objects.bulk_update(pending, ['position'], batch_size=1000)
+        EventSequence.objects.filter(id=1).update(last_position=sequence.last_position + len(pending))
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(f'v2:{position}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the event position a cursor points at; raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        version, _, value = base64.urlsafe_b64decode(padded.encode()).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    if version not in ('v1', 'v2') or not value.isdigit():
+        raise ValueError('Invalid cursor')
+    if version == 'v1':
+        # Issued before positions existed: the id of the last event seen
+        return ConversationEvent.objects.filter(
+            id__lte=int(value), position__isnull=False
+        ).order_by('-id').values_list('position', flat=True).first() or 0
+    return int(value)
+
+
+def latest_cursor():
+    publish_events()
+    return encode_cursor(EventSequence.objects.values_list('last_position', flat=True).first() or 0)
+
+
+def user_events(user):
+    """Events visible to a user: everything in their chats and current groups,
+    plus their own removal from groups they have since left.
+
+    Removals list their users under ``payload['user_ids']``; rows written
+    before that carry a single ``payload['user_id']``.
+    """
+    summaries = ConversationSummary.objects.filter(user=user)
+    chat_ids = summaries.filter(chat__isnull=False).values('chat_id')
+    group_ids = summaries.filter(group__isnull=False).values('group_id')
+    left_group_ids = GroupMember.objects.filter(user=user, left_at__isnull=False).values('group_id')
+    if connection.features.supports_json_field_contains:
+        removed = Q(payload__user_ids__contains=[str(user.id)])
+    else:
+        # SQLite: match the quoted id inside the serialized list
+        removed = Q(payload__user_ids__icontains=f'"{user.id}"')
+
+    return ConversationEvent.objects.filter(
+        Q(chat_id__in=chat_ids)
+        | Q(group_id__in=group_ids)
+        | (Q(group_id__in=left_group_ids, event_type='MEMBER_REMOVE') & (removed | Q(payload__user_id=str(user.id))))
+    )
+
+
+def fetch_changes(user, cursor, limit=None):
+    """Return ``(events, next_cursor, has_more)`` for events after ``cursor``"""
+    max_limit = getattr(settings, 'SYNC_PAGE_SIZE_MAX', 500)
+    limit = max(1, min(limit or max_limit, max_limit))
+    publish_events()
+    after = decode_cursor(cursor)
+
+    events = list(
+        user_events(user)
+        .filter(position__gt=after)
+        .select_related('message__sender')
+        .order_by('position')[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+    next_cursor = encode_cursor(events[-1].position) if events else cursor
+    return events, next_cursor, has_more
@@ -0,0 +1,96 @@
+"""Run with ``python manage.py test apps.messages --settings=benchmarks.settings``"""
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.messages.models import Chat, ConversationEvent, Message, ReadWatermark
+from apps.messages.persistence import backfill_sequence_numbers
+from apps.messages.ratelimit import FrameRateLimiter
+from apps.messages.summaries import add_participants, mark_read
+from apps.messages.sync import fetch_changes, latest_cursor
+from apps.messages.typing import TypingCoalescer
+from apps.messages.views import ChatViewSet
+from apps.users.models import User
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(phone_number='+15550000001', name='A')
+        self.other = User.objects.create(phone_number='+15550000002', name='B')
+        self.chat = Chat.objects.create(user1=self.user, user2=self.other)
+        add_participants('chat', self.chat.id, [self.user.id, self.other.id])
+
+    def test_event_committing_after_a_higher_id_is_not_skipped(self):
+        cursor = latest_cursor()
+        # Ids are taken before commit: id 20 commits and is synced first,
+        # then id 10 from a slower transaction commits
+        ConversationEvent.objects.create(id=20, event_type='EDIT', chat=self.chat)
+        events, cursor, _ = fetch_changes(self.user, cursor)
+        self.assertEqual([event.id for event in events], [20])
+
+        ConversationEvent.objects.create(id=10, event_type='EDIT', chat=self.chat)
+        events, cursor, _ = fetch_changes(self.user, cursor)
+        self.assertEqual([event.id for event in events], [10])
+
+        events, _, _ = fetch_changes(self.user, cursor)
+        self.assertEqual(events, [])
+
+
+class UnnumberedMessageTests(TestCase):
+    """Messages stored before ``Message.seq`` existed, until they are numbered"""
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='+15550000003', name='A')
+        self.other = User.objects.create(phone_number='+15550000004', name='B')
+        self.chat = Chat.objects.create(user1=self.user, user2=self.other)
+        add_participants('chat', self.chat.id, [self.user.id, self.other.id])
+        self.messages = [
+            Message.objects.create(chat=self.chat, sender=self.other, content=f'Legacy {i}') for i in range(3)
+        ]
+
+    def test_history_lists_unnumbered_messages(self):
+        ReadWatermark.advance(self.user, self.messages[0])
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.user)
+        response = ChatViewSet.as_view({'get': 'messages'})(request, pk=str(self.chat.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_reading_an_unnumbered_message(self):
+        self.assertTrue(mark_read(self.user, self.messages[1]))
+        self.assertFalse(mark_read(self.user, self.messages[0]))
+        watermark = ReadWatermark.objects.get(user=self.user, chat=self.chat)
+        self.assertEqual(watermark.last_read_message_id, self.messages[1].id)
+
+    def test_numbering_moves_watermarks(self):
+        mark_read(self.user, self.messages[1])
+        backfill_sequence_numbers(Chat)
+        self.assertEqual(
+            list(Message.objects.filter(chat=self.chat).order_by('created_at', 'id').values_list('seq', flat=True)),
+            [1, 2, 3]
+        )
+        self.assertEqual(Chat.objects.get(id=self.chat.id).last_seq, 3)
+        self.assertEqual(ReadWatermark.objects.get(user=self.user, chat=self.chat).last_read_seq, 2)
+
+
+class TypingRateLimitTests(TestCase):
+    def test_keystrokes_are_coalesced_and_stop_is_never_throttled(self):
+        limiter = FrameRateLimiter({'typing': '0/1'})
+        self.assertEqual(limiter.check('typing'), (True, False))
+        published = []
+
+        async def publish(conversation, is_typing):
+            published.append(is_typing)
+
+        async def type_and_stop():
+            coalescer = TypingCoalescer(publish, allow_start=lambda: limiter.allow('typing'))
+            for _ in range(20):
+                await coalescer.update(('chat', 'c'), True)
+            await coalescer.update(('chat', 'c'), False)
+            # The budget of one start is spent; further starts are dropped quietly
+            await coalescer.update(('chat', 'c'), True)
+            await coalescer.update(('chat', 'c'), False)
+
+        async_to_sync(type_and_stop)()
+        self.assertEqual(published, [True, False])
@@ -0,0 +1,91 @@
+"""Server-side coalescing of typing indicators.
+
+Clients report typing on every keystroke. Each connection keeps the last
+state it published per conversation and only lets a frame through to the
+channel layer when the state changes, or as a keep-alive once
+``TYPING_THROTTLE_SECONDS`` have passed. If no frame arrives for
+``TYPING_TIMEOUT_SECONDS`` a "stopped typing" event is published on the
+client's behalf. Starts beyond the connection's ``typing`` rate limit are
+dropped; stops always go through.
+"""
+
+import asyncio
+
+from django.conf import settings
+
+
+class TypingState:
+    __slots__ = ('is_typing', 'sent_at', 'timer')
+
+    def __init__(self):
+        self.is_typing = False
+        self.sent_at = 0.0
+        self.timer = None
+
+
+class TypingCoalescer:
+    """Per-connection typing state deciding which changes are published.
+
+    ``publish`` is an async callable taking ``(conversation, is_typing)``;
+    ``allow_start``, if given, is asked before publishing a change to typing.
+    """
+
+    def __init__(self, publish, throttle=None, timeout=None, allow_start=None):
+        self.publish = publish
+        self.allow_start = allow_start
+        self.throttle = throttle if throttle is not None else getattr(settings, 'TYPING_THROTTLE_SECONDS', 3)
+        self.timeout = timeout if timeout is not None else getattr(settings, 'TYPING_TIMEOUT_SECONDS', 6)
+        self.states = {}
+
+    async def update(self, conversation, is_typing):
+        """Handle a typing frame; returns True if an event was published"""
+        loop = asyncio.get_running_loop()
+        state = self.states.setdefault(conversation, TypingState())
+        self._cancel_timer(state)
+
+        if is_typing:
+            if not state.is_typing and self.allow_start is not None and not self.allow_start():
+                self.states.pop(conversation, None)
+                return False
+            state.timer = loop.call_later(self.timeout, self._expire, conversation)
+            if state.is_typing and loop.time() - state.sent_at < self.throttle:
+                return False
+        elif not state.is_typing:
+            self.states.pop(conversation, None)
+            return False
+
+        await self._publish(conversation, state, is_typing)
+        return True
+
+    def clear(self, conversation):
+        """Forget typing state without publishing, e.g. once a message was sent"""
+        state = self.states.pop(conversation, None)
+        if state is not None:
+            self._cancel_timer(state)
+
+    async def stop_all(self):
+        """Publish "stopped typing" for every conversation still marked typing"""
+        for conversation, state in list(self.states.items()):
+            self._cancel_timer(state)
+            if state.is_typing:
+                await self._publish(conversation, state, False)
+        self.states.clear()
+
+    async def _publish(self, conversation, state, is_typing):
+        state.is_typing = is_typing
+        state.sent_at = asyncio.get_running_loop().time()
+        if not is_typing:
+            self.states.pop(conversation, None)
+        await self.publish(conversation, is_typing)
+
+    def _expire(self, conversation):
+        state = self.states.get(conversation)
+        if state is not None and state.is_typing:
+            state.timer = None
+            asyncio.ensure_future(self._publish(conversation, state, False))
+
+    @staticmethod
+    def _cancel_timer(state):
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
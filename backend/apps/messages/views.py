@@ -2,15 +2,176 @@ from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
 from django.utils import timezone
 from datetime import timedelta
 
-from apps.messages.models import Chat, Group, GroupMember, Message, MessageReaction, ReadReceipt
+from apps.messages.models import (
+    Chat, ConversationEvent, Group, GroupMember, Message, MessageReaction, MessageReactionCount, ReadReceipt,
+    ReadWatermark, conversation_of
+)
+from apps.messages.consumers import notify_users
+from apps.messages.fanout import update_shard_count
+from apps.messages.membership import invalidate_members, is_member
+from apps.messages.pagination import paginate_messages, paginate_recent
+from apps.messages.persistence import save_message_now
+from apps.messages.roster import bump_roster_version, get_roster, roster_etag
+from apps.messages.summaries import (
+    add_participants, get_inbox, get_unread_totals, read_conversations, refresh_preview, remove_participants, set_muted
+)
+from apps.messages.sync import (
+    fetch_changes, latest_cursor, record_event, record_membership_events
+)
 from apps.messages.serializers import (
-    ChatSerializer, GroupSerializer, MessageSerializer, 
-    CreateMessageSerializer, MessageReactionSerializer
+    ChatSerializer, GroupSerializer, MessageSerializer, MessageRowSerializer, ReadWatermarkReceiptSerializer,
+    CreateMessageSerializer, MessageReactionSerializer, ConversationEventSerializer, ConversationSummarySerializer,
+    BulkReadSerializer, GroupMembersSerializer
 )
 from apps.users.models import User
+from utils.conditional import latest, make_etag, not_modified, with_validators
+
+
+def conversation_event(event_type, kind, conversation_id):
+    """Control event telling multiplexed sockets to (un)subscribe a conversation"""
+    return {
+        'type': event_type,
+        'conversation_type': kind,
+        'conversation_id': str(conversation_id),
+    }
+
+
+def membership_changed(group, actor, added=(), removed=()):
+    """Propagate group membership changes to caches, inbox summaries, the sync log and open sockets"""
+    added, removed = list(added), list(removed)
+    invalidate_members('group', group.id)
+    bump_roster_version(group)
+    update_shard_count(group.id)
+    if added:
+        add_participants('group', group.id, added)
+        record_membership_events('MEMBER_ADD', group.id, added, actor=actor)
+        notify_users(added, conversation_event('conversation_added', 'group', group.id))
+    if removed:
+        remove_participants('group', group.id, removed)
+        record_membership_events('MEMBER_REMOVE', group.id, removed, actor=actor)
+        notify_users(removed, conversation_event('conversation_removed', 'group', group.id))
+
+
+def add_group_members(group, user_ids):
+    """Add users to a group with one lookup and one insert; call inside a transaction.
+    
+    Returns ``(added, not_found)``: ids that joined or rejoined, and ids with
+    no user. Current members are left alone.
+    """
+    user_ids = set(user_ids)
+    found = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    current = dict(GroupMember.objects.filter(group=group, user_id__in=found).values_list('user_id', 'left_at'))
+    
+    rejoined = [user_id for user_id, left_at in current.items() if left_at is not None]
+    new = [user_id for user_id in found if user_id not in current]
+    GroupMember.objects.bulk_create([GroupMember(group=group, user_id=user_id) for user_id in new], ignore_conflicts=True)
+    if rejoined:
+        GroupMember.objects.filter(group=group, user_id__in=rejoined).update(left_at=None)
+    return new + rejoined, sorted(user_ids - found, key=str)
+
+
+def history_version(**conversation):
+    """``(last event id, last change)`` of a conversation
+    
+    Messages, edits, deletions and reactions all append to the event log and
+    reads move a watermark, so a history page cannot change without one of
+    the two moving. Sender profile edits are not tracked.
+    """
+    # Newest event by id is one probe on the (conversation, id) index; ids are
+    # monotonic, so its created_at is the latest too
+    last_event_id, last_event_at = ConversationEvent.objects.filter(**conversation).order_by('-id').values_list(
+        'id', 'created_at'
+    ).first() or (None, None)
+    last_read = ReadWatermark.objects.filter(**conversation).order_by('-updated_at').values_list(
+        'updated_at', flat=True
+    ).first()
+    return (last_event_id, last_read), latest(last_event_at, last_read)
+
+
+def message_history(request, messages, **conversation):
+    """Keyset-paginated history of one conversation; see apps.messages.pagination
+    
+    Answers 304 from the conversation's version without loading the page.
+    """
+    version, last_modified = history_version(**conversation)
+    etag = make_etag('messages', request.user.id, request.get_full_path(), *version)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+    
+    try:
+        page = paginate_messages(MessageRowSerializer.prepare_queryset(messages), request.query_params)
+    except ValueError:
+        return Response({'error': 'Invalid cursor or limit'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    context = page_context(request.user, page.messages, **conversation)
+    return with_validators(Response({
+        'results': MessageRowSerializer(page.messages, many=True, context=context).data,
+        'has_more': page.has_more,
+        'before': page.before,
+        'after': page.after,
+    }), etag, last_modified)
+
+
+def recent_page(request, rows, serializer_class, version=None, id_field='id', **kwargs):
+    """Keyset-paginated list of the user's conversations, most recently active first
+    
+    With ``version`` (row -> tuple of the fields the serializer shows), the
+    page gets an ETag and a matching request is answered 304 unserialized.
+    """
+    try:
+        page = paginate_recent(rows, request.query_params, id_field=id_field)
+    except ValueError:
+        return Response({'error': 'Invalid cursor or limit'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    etag = None
+    if version is not None:
+        etag = make_etag(request.user.id, request.get_full_path(), page.has_more, *map(version, page.items))
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+    
+    return with_validators(Response({
+        'results': serializer_class(page.items, many=True, **kwargs).data,
+        'has_more': page.has_more,
+        'before': page.before,
+    }), etag)
+
+
+def page_context(user, messages, **conversation):
+    """MessageRowSerializer context for a page of one conversation, loaded in two queries"""
+    if not messages:
+        return {'read_receipts': [], 'own_reactions': {}}
+    
+    own_reactions = {}
+    for message_id, emoji in MessageReaction.objects.filter(
+        message__in=messages, user=user
+    ).values_list('message_id', 'emoji'):
+        own_reactions.setdefault(message_id, []).append(emoji)
+    
+    # Only readers who got at least as far as the page's oldest message matter
+    watermarks = ReadWatermark.objects.filter(
+        last_read_seq__gte=min((message.seq for message in messages if message.seq is not None), default=0),
+        **conversation
+    ).order_by('-last_read_seq')
+    return {
+        'read_receipts': [
+            (w.last_read_seq, w.user_id, ReadWatermarkReceiptSerializer(w).data) for w in watermarks
+        ],
+        'own_reactions': own_reactions,
+    }
+
+
+def mute_conversation(request, kind, conversation_id):
+    muted = request.data.get('muted', True) not in (False, 'false', '0', 0)
+    if not set_muted(request.user.id, kind, conversation_id, muted):
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'is_muted': muted})
 
 
 class ChatViewSet(viewsets.ModelViewSet):
@@ -19,9 +180,18 @@ class ChatViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        """Get chats for current user"""
-        user = self.request.user
-        return Chat.objects.filter(user1=user) | Chat.objects.filter(user2=user)
+        """Get chats for current user through their conversation summaries"""
+        return Chat.objects.filter(summaries__user=self.request.user).annotate(
+            last_activity=F('summaries__last_activity'),
+            summary_id=F('summaries__id')
+        )
+    
+    def list(self, request):
+        return recent_page(
+            request, self.get_queryset(), ChatSerializer,
+            version=lambda chat: (chat.id, chat.updated_at, chat.last_activity),
+            id_field='summary_id'
+        )
     
     def create(self, request):
         """Create a new chat with a user"""
@@ -40,17 +210,23 @@ class ChatViewSet(viewsets.ModelViewSet):
         user2 = other_user if request.user.id < other_user.id else request.user
         
         chat, created = Chat.objects.get_or_create(user1=user1, user2=user2)
+        if created:
+            invalidate_members('chat', chat.id)
+            add_participants('chat', chat.id, [user1.id, user2.id])
+            notify_users([user1.id, user2.id], conversation_event('conversation_added', 'chat', chat.id))
         return Response(ChatSerializer(chat).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         """Get messages in a chat"""
         chat = self.get_object()
-        page = int(request.query_params.get('page', 0))
-        limit = int(request.query_params.get('limit', 50))
-        
-        messages = Message.objects.filter(chat=chat).order_by('-created_at')[page*limit:(page+1)*limit]
-        return Response(MessageSerializer(messages, many=True).data)
+        return message_history(request, Message.objects.filter(chat=chat), chat=chat)
+    
+    @action(detail=True, methods=['post'])
+    def mute(self, request, pk=None):
+        """Mute or unmute the chat in the caller's inbox (``muted``, default true)"""
+        chat = self.get_object()
+        return mute_conversation(request, 'chat', chat.id)
 
 
 class GroupViewSet(viewsets.ModelViewSet):
@@ -59,36 +235,54 @@ class GroupViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        """Get groups for current user"""
-        user = self.request.user
-        return Group.objects.filter(members__user=user, members__left_at__isnull=True).distinct()
+        """Get groups for current user through their conversation summaries, with member counts"""
+        member_count = GroupMember.objects.filter(
+            group=OuterRef('pk'), left_at__isnull=True
+        ).order_by().values('group').annotate(count=Count('id')).values('count')
+        return Group.objects.filter(summaries__user=self.request.user).annotate(
+            last_activity=F('summaries__last_activity'),
+            summary_id=F('summaries__id'),
+            member_count=Subquery(member_count)
+        )
+    
+    def list(self, request):
+        return recent_page(
+            request, self.get_queryset(), GroupSerializer,
+            version=lambda group: (group.id, group.updated_at, group.roster_version, group.last_activity),
+            id_field='summary_id'
+        )
+    
+    def retrieve(self, request, pk=None):
+        group = self.get_object()
+        etag = make_etag('group', group.id, group.updated_at, group.roster_version)
+        response = not_modified(request, etag, group.updated_at)
+        if response is not None:
+            return response
+        return with_validators(Response(GroupSerializer(group).data), etag, group.updated_at)
     
     def create(self, request):
         """Create a new group"""
         name = request.data.get('name')
-        member_ids = request.data.get('members', [])
         description = request.data.get('description', '')
         
         if not name:
             return Response({'error': 'Group name required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        group = Group.objects.create(
-            name=name,
-            description=description,
-            created_by=request.user
-        )
+        members = GroupMembersSerializer(data={'user_ids': request.data.get('members', [])})
+        members.is_valid(raise_exception=True)
         
-        # Add creator as admin
-        GroupMember.objects.create(group=group, user=request.user, is_admin=True)
-        
-        # Add other members
-        for member_id in member_ids:
-            try:
-                user = User.objects.get(id=member_id)
-                GroupMember.objects.create(group=group, user=user)
-            except User.DoesNotExist:
-                pass
+        with transaction.atomic():
+            group = Group.objects.create(
+                name=name,
+                description=description,
+                created_by=request.user
+            )
+            
+            # Add creator as admin, then the other members in one insert
+            GroupMember.objects.create(group=group, user=request.user, is_admin=True)
+            added, _ = add_group_members(group, members.validated_data['user_ids'])
         
+        membership_changed(group, request.user, added=[request.user.id, *added])
         return Response(GroupSerializer(group).data, status=status.HTTP_201_CREATED)
     
     def update(self, request, pk=None):
@@ -113,6 +307,32 @@ class GroupViewSet(viewsets.ModelViewSet):
         group.save()
         return Response(GroupSerializer(group).data)
     
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        """Get messages in a group"""
+        group = self.get_object()
+        return message_history(request, Message.objects.filter(group=group), group=group)
+    
+    @action(detail=True, methods=['get'])
+    def roster(self, request, pk=None):
+        """Current members with profiles
+        
+        Responds 304 when ``If-None-Match`` carries the ETag of the current
+        roster version.
+        """
+        group = self.get_object()
+        etag = roster_etag(group.id, group.roster_version)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return with_validators(Response({'roster_version': group.roster_version, 'members': get_roster(group)}), etag)
+    
+    @action(detail=True, methods=['post'])
+    def mute(self, request, pk=None):
+        """Mute or unmute the group in the caller's inbox (``muted``, default true)"""
+        group = self.get_object()
+        return mute_conversation(request, 'group', group.id)
+    
     @action(detail=True, methods=['post'])
     def add_member(self, request, pk=None):
         """Add member to group (admin only)"""
@@ -125,10 +345,35 @@ class GroupViewSet(viewsets.ModelViewSet):
         try:
             user = User.objects.get(id=user_id)
             member, created = GroupMember.objects.get_or_create(group=group, user=user)
+            rejoined = not created and member.left_at is not None
+            if rejoined:
+                member.left_at = None
+                member.save(update_fields=['left_at'])
+            if created or rejoined:
+                membership_changed(group, request.user, added=[user.id])
             return Response(status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    @action(detail=True, methods=['post'])
+    def add_members(self, request, pk=None):
+        """Add several members to group (admin only)"""
+        group = self.get_object()
+        
+        if not GroupMember.objects.filter(group=group, user=request.user, is_admin=True).exists():
+            return Response({'error': 'Insufficient permissions'}, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = GroupMembersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            added, unknown = add_group_members(group, serializer.validated_data['user_ids'])
+        if added:
+            membership_changed(group, request.user, added=added)
+        return Response({
+            'added': [str(user_id) for user_id in added],
+            'not_found': [str(user_id) for user_id in unknown],
+        }, status=status.HTTP_201_CREATED if added else status.HTTP_200_OK)
+    
     @action(detail=True, methods=['post'])
     def remove_member(self, request, pk=None):
         """Remove member from group (admin only)"""
@@ -138,14 +383,16 @@ class GroupViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Insufficient permissions'}, status=status.HTTP_403_FORBIDDEN)
         
         user_id = request.data.get('user_id')
-        GroupMember.objects.filter(group=group, user_id=user_id).update(left_at=timezone.now())
+        if GroupMember.objects.filter(group=group, user_id=user_id, left_at__isnull=True).update(left_at=timezone.now()):
+            membership_changed(group, request.user, removed=[user_id])
         return Response(status=status.HTTP_200_OK)
     
     @action(detail=True, methods=['post'])
     def leave(self, request, pk=None):
         """Leave group"""
         group = self.get_object()
-        GroupMember.objects.filter(group=group, user=request.user).update(left_at=timezone.now())
+        if GroupMember.objects.filter(group=group, user=request.user, left_at__isnull=True).update(left_at=timezone.now()):
+            membership_changed(group, request.user, removed=[request.user.id])
         return Response(status=status.HTTP_200_OK)
 
 
@@ -162,18 +409,20 @@ class MessageViewSet(viewsets.ViewSet):
         chat_type = serializer.validated_data['chat_type']
         content = serializer.validated_data['content']
         message_type = serializer.validated_data['message_type']
+        client_msg_id = serializer.validated_data.get('client_msg_id')
         
         if chat_type == 'chat':
             chat_id = serializer.validated_data['chat_id']
             try:
                 chat = Chat.objects.get(id=chat_id)
-                message = Message.objects.create(
+                message, created = save_message_now(Message(
                     chat=chat,
                     sender=request.user,
                     content=content,
-                    message_type=message_type
-                )
-                return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+                    message_type=message_type,
+                    client_msg_id=client_msg_id
+                ))
+                return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
             except Chat.DoesNotExist:
                 return Response({'error': 'Chat not found'}, status=status.HTTP_404_NOT_FOUND)
         
@@ -181,13 +430,14 @@ class MessageViewSet(viewsets.ViewSet):
             group_id = serializer.validated_data['group_id']
             try:
                 group = Group.objects.get(id=group_id)
-                message = Message.objects.create(
+                message, created = save_message_now(Message(
                     group=group,
                     sender=request.user,
                     content=content,
-                    message_type=message_type
-                )
-                return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+                    message_type=message_type,
+                    client_msg_id=client_msg_id
+                ))
+                return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
             except Group.DoesNotExist:
                 return Response({'error': 'Group not found'}, status=status.HTTP_404_NOT_FOUND)
     
@@ -204,15 +454,17 @@ class MessageViewSet(viewsets.ViewSet):
                 return Response({'error': 'Can only edit your own messages'}, status=status.HTTP_403_FORBIDDEN)
             
             # Check if message is < 15 minutes old
-            time_diff = timezone.now() - message.created_at
-            if time_diff.total_seconds() > 15 * 60:
+            if timezone.now() - message.created_at > Message.EDIT_WINDOW:
                 return Response({'error': 'Message can only be edited within 15 minutes'}, status=status.HTTP_400_BAD_REQUEST)
             
             message.content = new_content
             message.edited_at = timezone.now()
-            message.save()
+            with transaction.atomic():
+                message.save()
+                record_event('EDIT', message, actor=request.user)
+                refresh_preview(message)
             
-            return Response(MessageSerializer(message).data)
+            return Response(MessageSerializer(message, context={'request': request}).data)
         except Message.DoesNotExist:
             return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
     
@@ -224,11 +476,86 @@ class MessageViewSet(viewsets.ViewSet):
         
         try:
             message = Message.objects.get(id=message_id)
-            reaction, created = MessageReaction.objects.get_or_create(
-                message=message,
-                user=request.user,
-                emoji=emoji
-            )
+            with transaction.atomic():
+                reaction, created = MessageReaction.objects.get_or_create(
+                    message=message,
+                    user=request.user,
+                    emoji=emoji
+                )
+                if created:
+                    MessageReactionCount.adjust(message.id, emoji, 1)
+                    record_event('REACTION_ADD', message, actor=request.user, emoji=emoji)
             return Response(MessageReactionSerializer(reaction).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         except Message.DoesNotExist:
             return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    @action(detail=False, methods=['get'])
+    def reactions(self, request):
+        """Individual reactions on a message, optionally for one emoji
+        
+        Message pages only carry counts; clients load this list on demand.
+        """
+        message = Message.objects.filter(id=request.query_params.get('message_id')).only('id', 'chat_id', 'group_id').first()
+        if message is None or not is_member(*conversation_of(message), request.user.id):
+            return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        reactions = message.reactions.order_by('created_at')
+        emoji = request.query_params.get('emoji')
+        if emoji:
+            reactions = reactions.filter(emoji=emoji)
+        return Response(MessageReactionSerializer(reactions, many=True).data)
+    
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """The caller's chats and groups with last message and unread count, most recent first"""
+        return recent_page(request, get_inbox(request.user), ConversationSummarySerializer, context={'request': request})
+    
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        """Unread totals for the app badge, muted conversations excluded"""
+        messages, conversations = get_unread_totals(request.user.id)
+        return Response({'unread_messages': messages, 'unread_conversations': conversations})
+    
+    @action(detail=False, methods=['post'], url_path='read')
+    def read(self, request):
+        """Mark conversations read in bulk
+        
+        ``{"all": true}`` reads every conversation; otherwise each entry of
+        ``conversations`` is read up to its ``message_id`` or, without one,
+        to its last message.
+        """
+        serializer = BulkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        targets = None
+        if not serializer.validated_data['all']:
+            targets = [
+                (c['conversation_type'], c['conversation_id'], c.get('message_id'))
+                for c in serializer.validated_data.get('conversations', [])
+            ]
+        read = read_conversations(request.user, targets)
+        messages, conversations = get_unread_totals(request.user.id)
+        return Response({'read': read, 'unread_messages': messages, 'unread_conversations': conversations})
+    
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """Changes across all of the user's conversations since a cursor
+        
+        Without a cursor only the current cursor is returned; clients load
+        history through the per-conversation endpoints and sync from there.
+        """
+        cursor = request.query_params.get('cursor')
+        if not cursor:
+            return Response({'events': [], 'cursor': latest_cursor(), 'has_more': False})
+        
+        try:
+            limit = int(request.query_params.get('limit', 0)) or None
+            events, next_cursor, has_more = fetch_changes(request.user, cursor, limit)
+        except ValueError:
+            return Response({'error': 'Invalid cursor or limit'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'events': ConversationEventSerializer(events, many=True).data,
+            'cursor': next_cursor,
+            'has_more': has_more,
+        })
@@ -1,8 +1,10 @@
 """Celery tasks for notifications"""
 from celery import shared_task
 from apps.notifications.models import Notification
-from apps.messages.models import Message
+from apps.messages.models import ConversationSummary, Message, conversation_of
+from apps.messages.membership import get_member_ids
 from apps.users.models import Device
+from apps.users.presence import get_presence
 import firebase_admin
 from firebase_admin import credentials, messaging
 import logging
@@ -34,41 +36,46 @@ def send_notification_to_device(device_id, title, body, data=None):
 def notify_offline_users_new_message(message_id):
     """Notify offline users when they receive a new message"""
     try:
-        message = Message.objects.get(id=message_id)
+        message = Message.objects.select_related('sender').get(id=message_id)
         
         # Determine recipients
-        if message.chat:
-            if message.sender == message.chat.user1:
-                recipient = message.chat.user2
-            else:
-                recipient = message.chat.user1
-            recipients = [recipient]
-        elif message.group:
-            recipients = [
-                m.user for m in message.group.members.filter(left_at__isnull=True)
-                if m.user != message.sender
-            ]
-        else:
+        if not (message.chat_id or message.group_id):
             return
+        recipient_ids = get_member_ids(*conversation_of(message))
+        recipient_ids = set(recipient_ids) - {str(message.sender_id)}
         
-        # Send to each offline recipient
-        for recipient in recipients:
-            active_device = Device.objects.filter(user=recipient, is_active=True).first()
-            if active_device and active_device.fcm_token:
-                # Check if user is online via WebSocket
-                # This is simplified; in production, you'd check Redis for active connections
-                title = message.sender.name
-                if message.message_type == 'TEXT':
-                    body = message.content[:50]
-                else:
-                    body = f"[{message.message_type}]"
-                
-                send_notification_to_device.delay(
-                    active_device.device_id,
-                    title,
-                    body,
-                    {"message_id": str(message_id), "type": "message"}
-                )
+        # Users with an open WebSocket see the message live; skip them
+        offline_ids = recipient_ids - get_presence().online_user_ids(recipient_ids)
+        if offline_ids:
+            # Muted conversations still count unread messages but do not push
+            muted_ids = ConversationSummary.objects.filter(
+                user_id__in=offline_ids,
+                is_muted=True,
+                chat_id=message.chat_id,
+                group_id=message.group_id
+            ).values_list('user_id', flat=True)
+            offline_ids -= {str(user_id) for user_id in muted_ids}
+        if not offline_ids:
+            return
+        
+        title = message.sender.name
+        if message.message_type == 'TEXT':
+            body = message.content[:50]
+        else:
+            body = f"[{message.message_type}]"
+        
+        devices = Device.objects.filter(
+            user_id__in=offline_ids,
+            is_active=True,
+            fcm_token__isnull=False
+        ).exclude(fcm_token='').values_list('device_id', flat=True)
+        for device_id in devices:
+            send_notification_to_device.delay(
+                device_id,
+                title,
+                body,
+                {"message_id": str(message_id), "type": "message"}
+            )
     except Exception as e:
         logger.error(f"Error notifying users of new message: {str(e)}")
 
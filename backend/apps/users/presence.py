@@ -0,0 +1,108 @@
+"""Online presence of users.
+
+Every open WebSocket registers its channel name for its user and refreshes it
+periodically and on heartbeats; an entry expires ``PRESENCE_TTL_SECONDS`` after the last
+refresh, so crashed workers do not leave users online forever. A user is
+online while at least one unexpired entry exists.
+
+Presence is stored in the channel-layer Redis. With the in-memory channel
+layer (tests, single-process development) an in-process registry is used.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+
+def presence_ttl():
+    return getattr(settings, 'PRESENCE_TTL_SECONDS', 90)
+
+
+class InMemoryPresence:
+    """Process-local registry used when there is no Redis channel layer"""
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def touch(self, user_id, channel_name):
+        with self.lock:
+            self.connections.setdefault(str(user_id), {})[channel_name] = time.time() + presence_ttl()
+
+    def remove(self, user_id, channel_name):
+        with self.lock:
+            channels = self.connections.get(str(user_id), {})
+            channels.pop(channel_name, None)
+            if not channels:
+                self.connections.pop(str(user_id), None)
+
+    def online_user_ids(self, user_ids):
+        now = time.time()
+        with self.lock:
+            return {
+                str(user_id) for user_id in user_ids
+                if any(expires > now for expires in self.connections.get(str(user_id), {}).values())
+            }
+
+
+class RedisPresence:
+    """One sorted set per user: channel name scored by expiry time"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def key(user_id):
+        return f'presence:{user_id}'
+
+    def touch(self, user_id, channel_name):
+        now = time.time()
+        ttl = presence_ttl()
+        key = self.key(user_id)
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zadd(key, {channel_name: now + ttl})
+        pipe.expire(key, int(ttl) + 1)
+        pipe.execute()
+
+    def remove(self, user_id, channel_name):
+        self.client.zrem(self.key(user_id), channel_name)
+
+    def online_user_ids(self, user_ids):
+        """Check many users with one pipelined round trip"""
+        user_ids = [str(user_id) for user_id in user_ids]
+        if not user_ids:
+            return set()
+
+        now = time.time()
+        pipe = self.client.pipeline()
+        for user_id in user_ids:
+            pipe.zcount(self.key(user_id), now, '+inf')
+        return {user_id for user_id, count in zip(user_ids, pipe.execute()) if count}
+
+
+_presence = None
+
+
+def redis_client_from_channel_layer(config):
+    import redis
+
+    host = config.get('CONFIG', {}).get('hosts', [('localhost', 6379)])[0]
+    if isinstance(host, str):
+        return redis.Redis.from_url(host)
+    if isinstance(host, dict):
+        return redis.Redis.from_url(host['address']) if 'address' in host else redis.Redis(**host)
+    return redis.Redis(host=host[0], port=host[1])
+
+
+def get_presence():
+    """Return the process-wide presence registry"""
+    global _presence
+    if _presence is None:
+        layer = getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {})
+        if 'Redis' in layer.get('BACKEND', ''):
+            _presence = RedisPresence(redis_client_from_channel_layer(layer))
+        else:
+            _presence = InMemoryPresence()
+    return _presence
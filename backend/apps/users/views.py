@@ -7,6 +7,7 @@ from datetime import timedelta
 from django.conf import settings
 import secrets
 
+from apps.messages.roster import bump_member_rosters
 from apps.users.models import User, Device, OTPVerification, ContactList
 from apps.users.serializers import (
     UserSerializer, DeviceSerializer, SendOTPSerializer, 
@@ -14,7 +15,9 @@ from apps.users.serializers import (
 )
 from utils.sms import generate_otp, send_otp_sms
 from utils.encryption import hash_otp, verify_otp
+from utils.conditional import latest, make_etag, not_modified, with_validators
 from utils.jwt_auth import generate_token
+from utils.ws_auth import invalidate_device_cache, invalidate_user_cache
 
 
 class AuthViewSet(viewsets.ViewSet):
@@ -126,7 +129,9 @@ class AuthViewSet(viewsets.ViewSet):
             user.save()
         
         # Invalidate previous devices (single device login)
+        previous_devices = list(Device.objects.filter(user=user, is_active=True).values_list('device_id', flat=True))
         Device.objects.filter(user=user, is_active=True).update(is_active=False)
+        invalidate_device_cache(user.id, previous_devices + [device_id])
         
         # Create new device
         session_token = secrets.token_urlsafe(32)
@@ -169,6 +174,7 @@ class AuthViewSet(viewsets.ViewSet):
         if hasattr(request, 'auth'):
             device_id = request.auth.get('device_id')
             Device.objects.filter(user=user, device_id=device_id).update(is_active=False)
+            invalidate_device_cache(user.id, [device_id])
         
         return Response(
             {'message': 'Logged out successfully'},
@@ -181,15 +187,20 @@ class UserViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     
     def retrieve(self, request, pk=None):
-        """Get user profile"""
-        try:
-            user = User.objects.get(id=pk)
-            return Response(UserSerializer(user).data)
-        except User.DoesNotExist:
+        """Get user profile; answers 304 when the client's copy is current"""
+        user = User.objects.filter(id=pk).first()
+        if user is None:
             return Response(
                 {'error': 'User not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        
+        etag = make_etag('user', user.id, user.updated_at, user.last_seen)
+        last_modified = latest(user.updated_at, user.last_seen)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        return with_validators(Response(UserSerializer(user).data), etag, last_modified)
     
     @action(detail=False, methods=['put'], url_path='profile')
     def update_profile(self, request):
@@ -197,6 +208,8 @@ class UserViewSet(viewsets.ViewSet):
         serializer = UpdateProfileSerializer(request.user, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        invalidate_user_cache(request.user)
+        bump_member_rosters(request.user.id)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
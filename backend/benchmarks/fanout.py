@@ -0,0 +1,93 @@
+"""Fan-out CPU per broadcast message as group size grows.
+
+Compares encoding the client payload in every receiving consumer (the old
+behaviour) with encoding it once on the sender and forwarding the frames.
+Runs without Django, a database or Redis:
+
+    cd backend
+    python -m benchmarks.fanout --sizes 10 100 1000 5000 --msgpack-share 0.5 --json
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+from apps.messages.protocol import JSONCodec, MessagePackCodec, encode_frames, msgpack
+
+
+def sample_payload():
+    return {
+        'type': 'text_message_received',
+        'message_id': str(uuid.uuid4()),
+        'sender_id': str(uuid.uuid4()),
+        'sender_name': 'Benchmark Sender',
+        'content': 'The quick brown fox jumps over the lazy dog. ' * 2,
+        'message_type': 'TEXT',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'conversation_type': 'group',
+        'conversation_id': str(uuid.uuid4()),
+    }
+
+
+def receivers(size, msgpack_share):
+    binary = int(size * msgpack_share) if msgpack is not None else 0
+    return [MessagePackCodec()] * binary + [JSONCodec()] * (size - binary)
+
+
+def per_receiver_encoding(codecs, payload):
+    for codec in codecs:
+        codec.encode(dict(payload))
+
+
+def serialize_once(codecs, payload):
+    frames = encode_frames(payload)
+    for codec in codecs:
+        codec.forward(frames)
+
+
+def measure(fn, codecs, payload, messages):
+    start = time.process_time()
+    for _ in range(messages):
+        fn(codecs, payload)
+    return (time.process_time() - start) / messages
+
+
+def run(sizes, msgpack_share, messages):
+    payload = sample_payload()
+    results = []
+    for size in sizes:
+        codecs = receivers(size, msgpack_share)
+        before = measure(per_receiver_encoding, codecs, payload, messages)
+        after = measure(serialize_once, codecs, payload, messages)
+        results.append({
+            'group_size': size,
+            'per_receiver_us': round(before * 1e6, 2),
+            'serialize_once_us': round(after * 1e6, 2),
+            'speedup': round(before / after, 2) if after else None,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--msgpack-share', type=float, default=0.5,
+                        help='fraction of receivers using the MessagePack subprotocol')
+    parser.add_argument('--messages', type=int, default=50, help='broadcasts measured per group size')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.msgpack_share, args.messages)
+    if args.json:
+        print(json.dumps({'benchmark': 'fanout', 'msgpack_share': args.msgpack_share, 'results': results}, indent=2))
+        return
+
+    print(f"{'members':>8} {'per-receiver µs':>16} {'serialize-once µs':>18} {'speedup':>8}")
+    for row in results:
+        print(f"{row['group_size']:>8} {row['per_receiver_us']:>16} {row['serialize_once_us']:>18} {row['speedup']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Query budget of the message history endpoints.
+
+Serializes chat and group history pages of growing size and fails (exit
+status 1) if a page needs more than ``--budget`` queries or if the count
+grows with the page size. Two of the queries compute the page's ETag. Suitable
+for CI:
+
+    cd backend
+    python -m benchmarks.queries --sizes 1 10 50 100 --budget 7 --json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+from apps.messages.models import (  # noqa: E402
+    Chat, Group, GroupMember, Message, MessageReaction, MessageReactionCount, ReadWatermark
+)
+from apps.messages.summaries import rebuild  # noqa: E402
+from apps.messages.views import ChatViewSet, GroupViewSet  # noqa: E402
+from apps.users.models import User  # noqa: E402
+
+
+def create_history(messages, members):
+    """A chat and a group holding ``messages`` messages each, with reactions and read watermarks"""
+    users = [User(phone_number=f'+1666{i:07d}', name=f'Member {i}') for i in range(members)]
+    User.objects.bulk_create(users)
+    chat = Chat.objects.create(user1=users[0], user2=users[1])
+    group = Group.objects.create(name='Budget group', created_by=users[0])
+    GroupMember.objects.bulk_create([GroupMember(group=group, user=user) for user in users])
+
+    for conversation in ({'chat': chat}, {'group': group}):
+        rows = Message.objects.bulk_create([
+            Message(sender=users[i % 2], content=f'Message {i}', seq=i + 1, **conversation)
+            for i in range(messages)
+        ])
+        reactions = [
+            MessageReaction(message=message, user=user, emoji=emoji)
+            for message in rows
+            for user in users[:2]
+            for emoji in ('👍', '❤️')
+        ]
+        MessageReaction.objects.bulk_create(reactions)
+        MessageReactionCount.rebuild([message.id for message in rows])
+        ReadWatermark.objects.bulk_create([
+            ReadWatermark(
+                user=user, last_read_message=rows[-1], last_read_seq=rows[-1].seq, last_read_at=timezone.now(),
+                **conversation
+            )
+            for user in (users[:2] if 'chat' in conversation else users)
+        ])
+    rebuild()
+    return users[0], chat, group
+
+
+def page_queries(view, user, pk, size):
+    request = APIRequestFactory().get('/', {'limit': size})
+    force_authenticate(request, user=user)
+    with CaptureQueriesContext(connection) as captured:
+        response = view(request, pk=str(pk))
+        response.render()
+    assert response.status_code == 200, response.data
+    assert len(response.data['results']) == size
+    # Every message is read by someone, so the receipt path is part of the count
+    assert all(row['read_receipts'] for row in response.data['results'])
+    return len(captured.captured_queries)
+
+
+def run(sizes, members):
+    user, chat, group = create_history(max(sizes), members)
+    chat_view = ChatViewSet.as_view({'get': 'messages'})
+    group_view = GroupViewSet.as_view({'get': 'messages'})
+    return [
+        {
+            'page_size': size,
+            'chat_queries': page_queries(chat_view, user, chat.id, size),
+            'group_queries': page_queries(group_view, user, group.id, size),
+        }
+        for size in sizes
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--members', type=int, default=50, help='group members, each with a read watermark')
+    parser.add_argument('--budget', type=int, default=7, help='maximum queries per page')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run(args.sizes, args.members)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    counts = {row[key] for row in results for key in ('chat_queries', 'group_queries')}
+    passed = max(counts) <= args.budget and len({row['chat_queries'] for row in results}) == 1 \
+        and len({row['group_queries'] for row in results}) == 1
+
+    if args.json:
+        print(json.dumps({'benchmark': 'queries', 'budget': args.budget, 'passed': passed, 'results': results}, indent=2))
+    else:
+        print(f"{'page size':>10} {'chat queries':>13} {'group queries':>14}")
+        for row in results:
+            print(f"{row['page_size']:>10} {row['chat_queries']:>13} {row['group_queries']:>14}")
+        print('within budget' if passed else f'over budget of {args.budget} queries or growing with page size')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Settings for the benchmarks and the test suite.
+
+Uses the in-memory channel layer and a local-memory cache so nothing but the
+database is needed. The database is a throwaway test database: SQLite in
+memory by default, or the configured PostgreSQL server (``test_<DB_NAME>``)
+with ``BENCHMARK_DB=postgres``.
+"""
+
+import os
+
+from config.settings import *  # noqa: F401,F403
+
+# Only the consumers are exercised; contrib.messages would also clash with
+# the ``messages`` label of apps.messages
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ('daphne', 'django.contrib.admin', 'django.contrib.messages')]  # noqa: F405
+MIDDLEWARE = [m for m in MIDDLEWARE if 'messages' not in m]  # noqa: F405
+# config.urls mounts the admin site, which is not installed here
+ROOT_URLCONF = 'apps.messages.urls'
+
+if os.getenv('BENCHMARK_DB', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+    }
+
+# Room for bursts of the whole simulated population; the default of 100 per
+# channel silently drops deliveries
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 100000},
+    }
+}
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Simulated users send far faster than the per-connection limits allow
+WS_RATE_LIMITS = {}
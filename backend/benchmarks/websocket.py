@@ -0,0 +1,303 @@
+"""WebSocket load test of the chat consumers.
+
+Simulates users connected over ``WebsocketCommunicator`` (in-memory channel
+layer, throwaway test database, no Redis) sending text messages across
+one-on-one chats and groups. Reports connects/s, messages/s, end-to-end
+delivery latency and database queries per message:
+
+    cd backend
+    python -m benchmarks.websocket --users 200 --chats 100 --groups 10 --group-size 25 --json
+
+Each user opens one multiplexed ``/ws/user/`` socket by default; with
+``--endpoint conversation`` it opens one ``/ws/chat/`` or ``/ws/group/``
+socket per conversation instead. ``BENCHMARK_DB=postgres`` runs against a
+test database on the configured PostgreSQL server.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from channels.db import database_sync_to_async  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+
+from apps.messages import metrics  # noqa: E402
+from apps.messages.models import Chat, Group, GroupMember  # noqa: E402
+from apps.messages.routing import websocket_urlpatterns  # noqa: E402
+from apps.messages.summaries import rebuild  # noqa: E402
+from apps.users.models import Device, User  # noqa: E402
+from utils.jwt_auth import generate_token  # noqa: E402
+from utils.ws_auth import JWTAuthMiddlewareStack  # noqa: E402
+
+
+class QueryCounter:
+    """Counts queries on every database connection, including executor threads"""
+
+    def __init__(self):
+        self.count = 0
+        connection_created.connect(self.install, weak=False)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def create_fixtures(users, chats, groups, group_size, seed):
+    """Create users with devices, chats between random pairs and groups of random members, with inbox summaries"""
+    rng = random.Random(seed)
+    people = [User(phone_number=f'+1555{i:07d}', name=f'Load {i}') for i in range(users)]
+    User.objects.bulk_create(people)
+    Device.objects.bulk_create([
+        Device(user=user, device_id=f'bench-{user.phone_number}', session_token=f'bench-{user.id}')
+        for user in people
+    ])
+
+    pairs = set()
+    while len(pairs) < min(chats, users * (users - 1) // 2):
+        a, b = rng.sample(people, 2)
+        pairs.add((a, b) if str(a.id) < str(b.id) else (b, a))
+    chat_rows = Chat.objects.bulk_create([Chat(user1=a, user2=b) for a, b in pairs])
+
+    group_rows, members = [], []
+    for i in range(groups):
+        group = Group(name=f'Load group {i}', created_by=rng.choice(people))
+        group_rows.append(group)
+        members.append(rng.sample(people, min(group_size, users)))
+    Group.objects.bulk_create(group_rows)
+    GroupMember.objects.bulk_create([
+        GroupMember(group=group, user=user)
+        for group, group_members in zip(group_rows, members)
+        for user in group_members
+    ])
+    # The user socket subscribes to, and inserts update, the participants' summaries
+    rebuild()
+
+    conversations = {str(user.id): [] for user in people}
+    for chat in chat_rows:
+        for user_id in (chat.user1_id, chat.user2_id):
+            conversations[str(user_id)].append(('chat', str(chat.id)))
+    for group, group_members in zip(group_rows, members):
+        for user in group_members:
+            conversations[str(user.id)].append(('group', str(group.id)))
+
+    tokens = {str(user.id): generate_token(user.id, f'bench-{user.phone_number}') for user in people}
+    return conversations, tokens
+
+
+class Client:
+    """One simulated socket and the deliveries it has seen"""
+
+    def __init__(self, application, user_id, path, conversation=None):
+        self.user_id = user_id
+        self.conversation = conversation
+        self.communicator = WebsocketCommunicator(application, path)
+        self.reader = None
+
+    async def connect(self):
+        start = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError(f'Connection refused for user {self.user_id}')
+        return time.perf_counter() - start
+
+    def start_reading(self, on_message):
+        self.reader = asyncio.ensure_future(self.read(on_message))
+
+    async def read(self, on_message):
+        while True:
+            frame = await self.communicator.receive_from(timeout=3600)
+            on_message(json.loads(frame), time.perf_counter())
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+async def run(args):
+    queries = QueryCounter()
+    conversations, tokens = await database_sync_to_async(create_fixtures)(
+        args.users, args.chats, args.groups, args.group_size, args.seed
+    )
+    application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    clients = []
+    for user_id, token in tokens.items():
+        if args.endpoint == 'user':
+            clients.append(Client(application, user_id, f'/ws/user/?token={token}'))
+        else:
+            for kind, conversation_id in conversations[user_id]:
+                clients.append(Client(application, user_id, f'/ws/{kind}/{conversation_id}/?token={token}', (kind, conversation_id)))
+
+    # Connect in waves so the connect rate is not bounded by a single gather
+    start = time.perf_counter()
+    connect_times = []
+    for i in range(0, len(clients), args.connect_concurrency):
+        connect_times += await asyncio.gather(*(c.connect() for c in clients[i:i + args.connect_concurrency]))
+    connect_elapsed = time.perf_counter() - start
+
+    # Sockets receiving each conversation's events
+    receivers = {}
+    for client in clients:
+        subscribed = [client.conversation] if client.conversation else conversations[client.user_id]
+        for conversation in subscribed:
+            receivers[conversation] = receivers.get(conversation, 0) + 1
+
+    sent_at = {}
+    latencies = []
+    last_delivery = None
+    expected = 0
+    done = asyncio.Event()
+
+    def on_message(frame, received):
+        nonlocal last_delivery
+        if frame.get('type') != 'text_message_received':
+            return
+        sent = sent_at.get(frame.get('content'))
+        if sent is not None:
+            latencies.append(received - sent)
+            last_delivery = received
+            if len(latencies) >= expected:
+                done.set()
+
+    for client in clients:
+        client.start_reading(on_message)
+
+    senders = {}
+    for client in clients:
+        senders.setdefault(client.user_id, []).append(client)
+
+    rng = random.Random(args.seed)
+    plan = {
+        user_id: [(rng.choice(conversations[user_id]), f'{user_id}:{n}') for n in range(args.messages)]
+        for user_id in senders if conversations[user_id]
+    }
+    sent_total = sum(len(messages) for messages in plan.values())
+    expected = sum(receivers[conversation] for messages in plan.values() for conversation, _ in messages)
+
+    async def send(user_id, conversation, content):
+        socket = next(
+            c for c in senders[user_id]
+            if c.conversation is None or c.conversation == conversation
+        )
+        sent_at[content] = time.perf_counter()
+        await socket.communicator.send_to(text_data=json.dumps({
+            'type': 'text_message',
+            'conversation_type': conversation[0],
+            'conversation_id': conversation[1],
+            'content': content,
+        }))
+
+    async def user_loop(user_id):
+        for conversation, content in plan[user_id]:
+            await send(user_id, conversation, content)
+            if args.interval_ms:
+                await asyncio.sleep(args.interval_ms / 1000)
+
+    metrics.reset()
+    queries.count = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(user_id) for user_id in plan))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    # Throughput up to the last delivery, not up to the timeout if some were lost
+    elapsed = (last_delivery or time.perf_counter()) - start
+    message_queries = queries.count
+
+    await asyncio.gather(*(c.close() for c in clients))
+
+    return {
+        'benchmark': 'websocket',
+        'config': {
+            'users': args.users,
+            'chats': args.chats,
+            'groups': args.groups,
+            'group_size': args.group_size,
+            'messages_per_user': args.messages,
+            'endpoint': args.endpoint,
+            'database': connection.vendor,
+            'seed': args.seed,
+        },
+        'connections': len(clients),
+        'connects_per_s': round(len(clients) / connect_elapsed, 1),
+        'connect_ms': {
+            'p50': milliseconds(percentile(connect_times, 0.5)),
+            'p99': milliseconds(percentile(connect_times, 0.99)),
+        },
+        'messages': sent_total,
+        'messages_per_s': round(sent_total / elapsed, 1),
+        'deliveries': len(latencies),
+        'deliveries_expected': expected,
+        'latency_ms': {
+            'p50': milliseconds(percentile(latencies, 0.5)),
+            'p99': milliseconds(percentile(latencies, 0.99)),
+            'max': milliseconds(max(latencies) if latencies else None),
+        },
+        'db_queries_per_message': round(message_queries / sent_total, 2) if sent_total else None,
+        'metrics': metrics.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=5)
+    parser.add_argument('--group-size', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=10, help='messages sent by each user')
+    parser.add_argument('--interval-ms', type=float, default=0, help='pause between messages of one user')
+    parser.add_argument('--endpoint', choices=['user', 'conversation'], default='user')
+    parser.add_argument('--connect-concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for all deliveries')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"connections         {result['connections']}")
+    print(f"connects/s          {result['connects_per_s']}")
+    print(f"messages/s          {result['messages_per_s']}")
+    print(f"deliveries          {result['deliveries']}/{result['deliveries_expected']}")
+    print(f"latency p50/p99 ms  {result['latency_ms']['p50']} / {result['latency_ms']['p99']}")
+    print(f"db queries/message  {result['db_queries_per_message']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,17 +5,17 @@ ASGI config for whatsApp-VibeCode project with Django Channels support.
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
 from apps.messages.routing import websocket_urlpatterns
+from utils.ws_auth import JWTAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
     'http': get_asgi_application(),
-    'websocket': AuthMiddlewareStack(
+    'websocket': JWTAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
@@ -147,6 +147,73 @@ CHANNEL_LAYERS = {
     },
 }
 
+# WebSocket message write-behind buffer
+MESSAGE_WRITE_BUFFER_FLUSH_MS = int(os.getenv('MESSAGE_WRITE_BUFFER_FLUSH_MS', '5'))
+MESSAGE_WRITE_BUFFER_BATCH_SIZE = int(os.getenv('MESSAGE_WRITE_BUFFER_BATCH_SIZE', '100'))
+
+# Typing indicators: at most one event per user per conversation per throttle
+# window; "stopped typing" is sent for the client after the timeout
+TYPING_THROTTLE_SECONDS = float(os.getenv('TYPING_THROTTLE_SECONDS', '3'))
+TYPING_TIMEOUT_SECONDS = float(os.getenv('TYPING_TIMEOUT_SECONDS', '6'))
+
+# Cache (shared across processes so invalidations reach every worker)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv(
+            'CACHE_URL',
+            f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', '6379')}/1"
+        ),
+    },
+}
+
+# WebSocket JWT authentication: seconds a device-validity check is cached
+WS_AUTH_CACHE_TTL = int(os.getenv('WS_AUTH_CACHE_TTL', '60'))
+
+# Seconds a conversation's member list is cached (invalidated on change)
+MEMBERSHIP_CACHE_TTL = int(os.getenv('MEMBERSHIP_CACHE_TTL', '300'))
+
+# Presence: a socket counts as online this long after its last heartbeat
+PRESENCE_TTL_SECONDS = int(os.getenv('PRESENCE_TTL_SECONDS', '90'))
+
+# Largest page of events returned by the sync endpoint
+SYNC_PAGE_SIZE_MAX = int(os.getenv('SYNC_PAGE_SIZE_MAX', '500'))
+
+# Per-connection outbound queue; 'drop_ephemeral' drops typing events before
+# closing a slow connection, 'close' closes it as soon as the queue is full
+OUTBOUND_QUEUE_MAX_FRAMES = int(os.getenv('OUTBOUND_QUEUE_MAX_FRAMES', 256))
+OUTBOUND_OVERFLOW_POLICY = os.getenv('OUTBOUND_OVERFLOW_POLICY', 'drop_ephemeral')
+
+# WebSocket frame rate limits per connection and event class, as
+# "<frames per second>/<burst>"
+WS_RATE_LIMITS = {
+    'messages': os.getenv('WS_RATE_LIMIT_MESSAGES', '5/20'),
+    'reactions': os.getenv('WS_RATE_LIMIT_REACTIONS', '5/20'),
+    'typing': os.getenv('WS_RATE_LIMIT_TYPING', '2/10'),
+    'receipts': os.getenv('WS_RATE_LIMIT_RECEIPTS', '10/50'),
+    'heartbeat': os.getenv('WS_RATE_LIMIT_HEARTBEAT', '1/5'),
+}
+
+# Sharded fan-out: groups with at least FANOUT_SHARD_THRESHOLD members are
+# published to FANOUT_SHARD_COUNT sub-groups by FANOUT_WORKERS background workers
+FANOUT_SHARD_THRESHOLD = int(os.getenv('FANOUT_SHARD_THRESHOLD', 1000))
+FANOUT_SHARD_COUNT = int(os.getenv('FANOUT_SHARD_COUNT', 16))
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', 4))
+FANOUT_QUEUE_SIZE = int(os.getenv('FANOUT_QUEUE_SIZE', 10000))
+
+# How long client_msg_id -> message lookups stay cached for deduplicating
+# retried sends (seconds); older retries are caught by the unique index
+CLIENT_MSG_ID_CACHE_TTL = int(os.getenv('CLIENT_MSG_ID_CACHE_TTL', 900))
+
+# Message history page size cap
+MESSAGE_PAGE_SIZE_MAX = int(os.getenv('MESSAGE_PAGE_SIZE_MAX', '100'))
+
+# Seconds a rendered group roster is cached (keys are versioned, never invalidated)
+ROSTER_CACHE_TTL = int(os.getenv('ROSTER_CACHE_TTL', '3600'))
+
+# Seconds a user's unread totals (app badge) are cached (invalidated on change)
+UNREAD_CACHE_TTL = int(os.getenv('UNREAD_CACHE_TTL', '300'))
+
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
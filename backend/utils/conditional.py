@@ -0,0 +1,42 @@
+"""Conditional GET for API views.
+
+Views derive validators from version counters and timestamps they can read
+without loading or serializing the response body; ``not_modified`` answers
+304 when the client's copy is current and ``with_validators`` stamps the
+full response otherwise.
+"""
+
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Strong ETag over the given version parts"""
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def latest(*timestamps):
+    timestamps = [t for t in timestamps if t is not None]
+    return max(timestamps) if timestamps else None
+
+
+def with_validators(response, etag=None, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(int(last_modified.timestamp()))
+    return response
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """Return a 304 (or 412) response if the request's preconditions say so, else None"""
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if response is None:
+        return None
+    return with_validators(response, etag, last_modified)
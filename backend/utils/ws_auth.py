@@ -0,0 +1,89 @@
+"""JWT authentication for WebSocket connections"""
+
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+
+from utils.jwt_auth import verify_token
+
+
+def device_cache_key(user_id, device_id):
+    return f'ws_auth:{user_id}:{device_id}'
+
+
+def invalidate_device_cache(user_id, device_ids):
+    """Drop cached device validity, e.g. after logout or a new login"""
+    cache.delete_many([device_cache_key(user_id, device_id) for device_id in device_ids])
+
+
+def invalidate_user_cache(user):
+    """Drop cached entries for all devices of a user, e.g. after a profile change"""
+    from apps.users.models import Device
+
+    invalidate_device_cache(user.id, Device.objects.filter(user=user).values_list('device_id', flat=True))
+
+
+@database_sync_to_async
+def get_active_user(user_id, device_id):
+    """Return the user if ``device_id`` is their active device, else None.
+
+    Both outcomes are cached for ``WS_AUTH_CACHE_TTL`` seconds so reconnect
+    storms are served from the cache instead of the database.
+    """
+    from apps.users.models import Device
+
+    key = device_cache_key(user_id, device_id)
+    user = cache.get(key)
+    if user is None:
+        device = Device.objects.select_related('user').filter(
+            user_id=user_id,
+            device_id=device_id,
+            is_active=True,
+            user__is_active=True
+        ).first()
+        user = device.user if device else False
+        cache.set(key, user, getattr(settings, 'WS_AUTH_CACHE_TTL', 60))
+    return user or None
+
+
+def get_token(scope):
+    """JWT from the ``token`` query parameter or an ``Authorization: Bearer`` header"""
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        return token[0]
+
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            scheme, _, credentials = value.decode().partition(' ')
+            if scheme.lower() == 'bearer':
+                return credentials
+    return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Populate ``scope['user']`` from the JWT issued by ``generate_token``.
+
+    The signature is verified locally; only the single-active-device check
+    needs the database, and that goes through the cache.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = AnonymousUser()
+
+        token = get_token(scope)
+        payload = verify_token(token) if token else None
+        if payload:
+            user = await get_active_user(payload.get('user_id'), payload.get('device_id'))
+            if user is not None:
+                scope['user'] = user
+
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
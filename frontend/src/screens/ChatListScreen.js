@@ -21,7 +21,7 @@ export default function ChatListScreen({ navigation }) {
     setLoading(true);
     try {
       const response = await chatService.getChats();
-      dispatch({ type: 'SET_CHATS', payload: response.data.chats || [] });
+      dispatch({ type: 'SET_CHATS', payload: response.data.results || [] });
     } catch (error) {
       console.error('Error fetching chats:', error);
     } finally {
@@ -27,7 +27,7 @@ export default function ChatScreen({ route }) {
 
       try {
         const response = await chatService.getMessages(chatId);
-        setMessages(response.data);
+        setMessages(response.data.results);
         setLoading(false);
 
         // Connect WebSocket
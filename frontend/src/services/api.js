@@ -53,9 +53,10 @@ export const chatService = {
   
   createChat: (userId) => api.post('/messages/chats/', { user_id: userId }),
   
-  getMessages: (chatId, page = 0, limit = 50) =>
+  // Newest page first; pass the previous response's `before` cursor to scroll back
+  getMessages: (chatId, before = null, limit = 50) =>
     api.get(`/messages/chats/${chatId}/messages/`, {
-      params: { page, limit },
+      params: before ? { before, limit } : { limit },
     }),
   
   sendMessage: (data) => api.post('/messages/send/', data),
@@ -63,6 +64,15 @@ export const chatService = {
   editMessage: (data) => api.patch('/messages/edit/', data),
   
   addReaction: (data) => api.post('/messages/react/', data),
+  
+  getInbox: () => api.get('/messages/inbox/'),
+  
+  // App badge: { unread_messages, unread_conversations }
+  getUnread: () => api.get('/messages/unread/'),
+  
+  // conversations: [{ conversation_type, conversation_id, message_id? }], or null for all
+  markRead: (conversations = null) =>
+    api.post('/messages/read/', conversations ? { conversations } : { all: true }),
 };
 
 export const groupService = {
@@ -70,11 +80,21 @@ export const groupService = {
   
   getGroup: (groupId) => api.get(`/messages/groups/${groupId}/`),
   
+  // Pass the ETag of a cached roster to get 304 Not Modified when unchanged
+  getRoster: (groupId, etag = null) =>
+    api.get(`/messages/groups/${groupId}/roster/`, {
+      headers: etag ? { 'If-None-Match': etag } : {},
+      validateStatus: (status) => status === 200 || status === 304,
+    }),
+  
   updateGroup: (groupId, data) => api.put(`/messages/groups/${groupId}/`, data),
   
   addMember: (groupId, userId) =>
     api.post(`/messages/groups/${groupId}/add_member/`, { user_id: userId }),
   
+  addMembers: (groupId, userIds) =>
+    api.post(`/messages/groups/${groupId}/add_members/`, { user_ids: userIds }),
+  
   removeMember: (groupId, userId) =>
     api.delete(`/messages/groups/${groupId}/members/${userId}/`),
   
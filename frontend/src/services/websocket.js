@@ -6,11 +6,14 @@ let socket = null;
 let reconnectAttempts = 0;
 const MAX_RECONNECT_ATTEMPTS = 5;
 const RECONNECT_DELAY = 3000;
+// Well inside the server's PRESENCE_TTL_SECONDS (90s by default)
+const HEARTBEAT_INTERVAL = 30000;
 
 export class WebSocketService {
   constructor() {
     this.callbacks = {};
     this.reconnectTimer = null;
+    this.heartbeatTimer = null;
   }
 
   async connect(chatId, token, isGroup = false) {
@@ -24,6 +27,7 @@ export class WebSocketService {
         socket.onopen = () => {
           console.log('WebSocket connected');
           reconnectAttempts = 0;
+          this.startHeartbeat();
           resolve();
         };
 
@@ -39,6 +43,7 @@ export class WebSocketService {
 
         socket.onclose = () => {
           console.log('WebSocket disconnected');
+          this.stopHeartbeat();
           this.attemptReconnect(chatId, token, isGroup);
         };
       } catch (error) {
@@ -47,6 +52,18 @@ export class WebSocketService {
     });
   }
 
+  startHeartbeat() {
+    this.stopHeartbeat();
+    this.heartbeatTimer = setInterval(() => this.send({ type: 'heartbeat' }), HEARTBEAT_INTERVAL);
+  }
+
+  stopHeartbeat() {
+    if (this.heartbeatTimer) {
+      clearInterval(this.heartbeatTimer);
+      this.heartbeatTimer = null;
+    }
+  }
+
   handleMessage(data) {
     const messageType = data.type;
     if (this.callbacks[messageType]) {
@@ -139,6 +156,7 @@ export class WebSocketService {
   }
 
   disconnect() {
+    this.stopHeartbeat();
     if (this.reconnectTimer) {
       clearTimeout(this.reconnectTimer);
     }